@@ -0,0 +1,59 @@
+import numpy as np
+
+from src.backtest_signals import SignalBatch
+
+
+# Holdings and pending trade signals keyed by symbol id
+# Signals are netted per symbol into one signed quantity, buys are positive and sells negative
+class PositionBook:
+    __slots__ = ['holdings', 'signals']
+
+    def __init__(self, holdings=None, trade_signals=()):
+        self.holdings = holdings if holdings is not None else dict()
+        self.signals = dict()
+
+        for signal_type, symbol, quantity in trade_signals:
+            self.add_signal(signal_type, symbol, quantity)
+
+    def __len__(self):
+        return len(self.signals)
+
+    def position(self, symbol):
+        return self.holdings.get(symbol, 0)
+
+    # Net signed quantity of the pending signals of a symbol, 0 when there are none
+    def signal(self, symbol):
+        return self.signals.get(symbol, 0)
+
+    def add_signal(self, signal_type, symbol, quantity):
+        self.amend(symbol, self.signals.get(symbol, 0) + signal_type * quantity)
+
+    def amend(self, symbol, net_quantity):
+        if net_quantity:
+            self.signals[symbol] = net_quantity
+        else:
+            self.signals.pop(symbol, None)
+
+    def cancel(self, symbol):
+        self.signals.pop(symbol, None)
+
+    def trade_signals(self):
+        quantities = np.fromiter(self.signals.values(), dtype=np.int64, count=len(self.signals))
+        symbols = np.fromiter(self.signals.keys(), dtype=np.int32, count=len(self.signals))
+        return SignalBatch.from_arrays(np.sign(quantities), symbols, np.abs(quantities))
+
+    # Applies every pending signal to the holdings at the given price row and returns the cash flow of the fills
+    def fill(self, prices):
+        if not self.signals:
+            return 0
+
+        symbols = np.fromiter(self.signals.keys(), dtype=np.intp, count=len(self.signals))
+        quantities = np.fromiter(self.signals.values(), dtype=np.int64, count=len(self.signals))
+
+        for s, q in self.signals.items():
+            # Lazy add symbols to holdings if they don't already exist
+            self.holdings[s] = self.holdings.get(s, 0) + q
+
+        self.signals.clear()
+        return -float(np.dot(quantities, prices[symbols]))
+
@@ -0,0 +1,20 @@
+from src.backtest_utils import ResultWriter, FSYNC_ON_FLUSH
+
+# Settings a branch takes from its own engine once the branch period is reached, every other setting is the parent's
+BRANCH_SETTING_KEYS = ("period", "strategy", "stopping_policies", "transaction_cost", "max_stock_percentage")
+
+
+# First record of a branch's results, load_data reads the parent's first `time` records in its place
+def branch_header(parent, time):
+    return {"branch_of": list(parent), "branch_time": time}
+
+
+# Switches a run restored from its parent's checkpoint over to the branch at period args["time"]
+# Earlier periods were simulated with the parent's settings and are not written, the results start with a reference to the parent
+def start_branch(args, parent, settings):
+    args.update(settings)
+    args.pop("stopping_state", None)
+
+    writer = ResultWriter(args["user_id"], args["strategy_id"], args["backtest_id"], flush_interval=args.get("flush_interval", 100), fsync_policy=args.get("fsync_policy", FSYNC_ON_FLUSH))
+    writer.write(branch_header(parent, args["time"]))
+    args["result_writer"] = writer
@@ -0,0 +1,147 @@
+import os
+import pickle
+import shutil
+from time import time_ns
+
+import src.backtest_utils as backtest_utils
+from src.backtest_portfolio import Portfolio
+
+CHECKPOINT_INTERVAL = 500
+CHECKPOINT_SUFFIX = ".ckpt"
+CHECKPOINT_RUN_FILE = "run"
+
+# Run settings stored with every checkpoint, a resumed run is rebuilt from them alone
+CHECKPOINT_CONFIG_KEYS = ("user_id", "strategy_id", "backtest_id", "period", "initial_funds", "transaction_cost", "max_stock_percentage", "flush_interval", "fsync_policy",
+                          "universe_filter", "data_source", "strategy", "stopping_policies", "checkpoint_interval", "run")
+
+
+def checkpoint_dir(user_id, strategy_id, backtest_id):
+    return "./backtest_checkpoints/{}-{}-{}".format(user_id, strategy_id, backtest_id)
+
+
+def checkpoint_path(user_id, strategy_id, backtest_id, time):
+    return os.path.join(checkpoint_dir(user_id, strategy_id, backtest_id), "{:08d}{}".format(time, CHECKPOINT_SUFFIX))
+
+
+# Periods with a checkpoint, oldest first
+def list_checkpoints(user_id, strategy_id, backtest_id):
+    path = checkpoint_dir(user_id, strategy_id, backtest_id)
+
+    if not os.path.isdir(path):
+        return []
+
+    return sorted(int(f[:-len(CHECKPOINT_SUFFIX)]) for f in os.listdir(path) if f.endswith(CHECKPOINT_SUFFIX))
+
+
+# Written to a temporary file and renamed over the target, a crash while saving leaves the previous checkpoints intact
+def save_checkpoint(path, state):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(path + ".tmp", path)
+
+
+def load_checkpoint(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+# Backtest ids are reused once the runner restarts, every run starting from scratch drops the checkpoints of an earlier run with its ids
+# Runs that take checkpoints record their identity, a checkpoint is only used while it belongs to the run that last started with its ids
+def start_checkpoints(user_id, strategy_id, backtest_id, run=None):
+    path = checkpoint_dir(user_id, strategy_id, backtest_id)
+    shutil.rmtree(path, ignore_errors=True)
+
+    if run is not None:
+        save_checkpoint(os.path.join(path, CHECKPOINT_RUN_FILE), run)
+
+    return run
+
+
+# Seed and start stamp of a run, stored with its checkpoints
+def run_identity():
+    return {"seed": backtest_utils.seed, "started": time_ns()}
+
+
+def current_run(user_id, strategy_id, backtest_id):
+    path = os.path.join(checkpoint_dir(user_id, strategy_id, backtest_id), CHECKPOINT_RUN_FILE)
+    return load_checkpoint(path) if os.path.isfile(path) else None
+
+
+# Latest checkpoint taken at or before the given period, None when the run has none or it was left by an earlier run
+def latest_checkpoint(user_id, strategy_id, backtest_id, time=None):
+    times = [t for t in list_checkpoints(user_id, strategy_id, backtest_id) if time is None or t <= time]
+
+    if not times:
+        return None
+
+    state = load_checkpoint(checkpoint_path(user_id, strategy_id, backtest_id, times[-1]))
+    run = current_run(user_id, strategy_id, backtest_id)
+
+    if run is None or state["config"].get("run") != run:
+        print("Stale Checkpoint Ignored:", user_id, strategy_id, backtest_id, "| Period:", times[-1])
+        return None
+
+    return state
+
+
+# Complete state of a run once period args["time"] finished: settings, funds, shares, the current price and volume rows,
+# the portfolio marks, every random stream and the length of the results already on disk
+# rng is the random stream state when another process than the caller draws from it, see get_rng_state
+def capture_checkpoint(args, rng=None):
+    time = args["time"]
+    portfolio = args["portfolio"]
+
+    return {"time": time, "config": {k: args.get(k) for k in CHECKPOINT_CONFIG_KEYS},
+            "funds": args["funds"][time], "shares": dict(args["shares"][time]),
+            "prices": args["prices"][time].copy(), "volumes": args["volumes"][time].copy(),
+            "portfolio": (portfolio.funds, portfolio.market_value), "share_prices": list(args["share_prices"]),
+            "stopping_state": args.get("stopping_state"), "rng": rng or backtest_utils.get_rng_state(), "result_offset": args["result_writer"].tell()}
+
+
+def push_checkpoint(args, rng=None):
+    save_checkpoint(checkpoint_path(args["user_id"], args["strategy_id"], args["backtest_id"], args["time"]), capture_checkpoint(args, rng))
+
+
+# Restores the settings, books and statistics of a captured state into a fresh args dict, the run continues from the returned period
+def restore_args(args, state):
+    time = state["time"]
+
+    # Engines loading the strategy by strategy_id store none, the resuming engine keeps the strategy it loaded the same way
+    args.update({k: v for k, v in state["config"].items() if k not in ("user_id", "strategy_id", "backtest_id") and not (k == "strategy" and v is None)})
+
+    # Per period lists are indexed by time, the periods before the checkpoint are never read again
+    args["funds"] = [None] * time + [state["funds"]]
+    args["shares"] = [None] * time + [dict(state["shares"])]
+    args["buy_count"] = [0] * (time + 1)
+    args["sell_count"] = [0] * (time + 1)
+    args["trade_signals"] = [None] * (time + 1)
+    args["universe"] = [None] * (time + 1)
+    args["share_prices"] = list(state["share_prices"])
+
+    if state["stopping_state"] is not None:
+        args["stopping_state"] = state["stopping_state"]
+
+    portfolio = Portfolio(state["funds"], state["shares"], state["prices"])
+    portfolio.funds, portfolio.market_value = state["portfolio"]
+    args["portfolio"] = portfolio
+
+    args["time"] = time + 1
+    return time + 1
+
+
+# Restores a captured state into a fresh args dict, the market data and the random streams of a single process run
+def restore_checkpoint(args, market_data, state):
+    market_data.resume(state["time"], state["prices"], state["volumes"])
+    backtest_utils.set_rng_state(state["rng"])
+    return restore_args(args, state)
+
+
+# Cuts the results file of a resumed run back to the checkpoint, records of the periods after it are appended again
+def rewind_results(args, state):
+    os.truncate(backtest_utils.result_path(args["user_id"], args["strategy_id"], args["backtest_id"]), state["result_offset"])
+    args["result_mode"] = "append"
@@ -0,0 +1,113 @@
+import asyncio
+
+import aiohttp
+from bs4 import BeautifulSoup, SoupStrainer
+
+QUOTE_URL = "https://finance.yahoo.com/quote/{symbol}"
+
+FETCH_CONCURRENCY = 16
+FETCH_RETRIES = 3
+FETCH_BACKOFF = 0.5
+FETCH_TIMEOUT = 10
+
+
+def parse_quote_page(page):
+    data = BeautifulSoup(page, "html.parser", parse_only=SoupStrainer("span"))
+
+    price_tag = data.find("span", {"class": "Trsdu(0.3s) Fw(b) Fz(36px) Mb(-4px) D(ib)", "data-reactid": "52"})
+    volume_tag = data.find("span", {"class": "Trsdu(0.3s)", "data-reactid": "72"})
+
+    price = None
+    volume = None
+
+    try:
+        if price_tag:
+            price = float(price_tag.text.replace(',', ''))
+
+        if volume_tag:
+            volume = int(volume_tag.text.replace(',', ''))
+    except ValueError:
+        pass
+
+    return price, volume
+
+
+async def _fetch_quote(session, url, retries, backoff):
+    for attempt in range(retries + 1):
+        try:
+            async with session.get(url) as response:
+                # Client errors are final, server errors and rate limits are retried
+                if response.status < 500 and response.status != 429:
+                    response.raise_for_status()
+                    return parse_quote_page(await response.text())
+        except aiohttp.ClientResponseError:
+            return None, None
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+
+        if attempt < retries:
+            await asyncio.sleep(backoff * 2 ** attempt)
+
+    return None, None
+
+
+async def _fetch_worker(session, symbols, channel, url, retries, backoff):
+    while True:
+        try:
+            symbol = symbols.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+
+        # Any other failure, e.g. an undecodable or unparsable page, only fails this symbol, every symbol is put on the channel
+        try:
+            price, volume = await _fetch_quote(session, url.format(symbol=symbol), retries, backoff)
+        except Exception as e:
+            print("Failed to Fetch Quote:", symbol, repr(e))
+            price, volume = None, None
+
+        await channel.put((symbol, price, volume))
+
+
+# Yields (symbol, price, volume) through a channel as soon as each quote is fetched, a failed fetch yields None values
+async def stream_quotes(symbols, concurrency=FETCH_CONCURRENCY, url=QUOTE_URL, retries=FETCH_RETRIES, backoff=FETCH_BACKOFF, timeout=FETCH_TIMEOUT):
+    pending = asyncio.Queue()
+    channel = asyncio.Queue()
+
+    for s in symbols:
+        pending.put_nowait(s)
+
+    concurrency = max(1, min(concurrency, len(symbols)))
+
+    # The connector pools and reuses keep-alive connections across every worker
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        workers = [asyncio.create_task(_fetch_worker(session, pending, channel, url, retries, backoff)) for _ in range(concurrency)]
+
+        try:
+            for _ in range(len(symbols)):
+                yield await channel.get()
+        finally:
+            for w in workers:
+                w.cancel()
+
+            await asyncio.gather(*workers, return_exceptions=True)
+
+
+async def _collect_quotes(symbols, progress, **kwargs):
+    prices = dict()
+    volumes = dict()
+
+    async for symbol, price, volume in stream_quotes(symbols, **kwargs):
+        prices[symbol] = price
+        volumes[symbol] = volume
+
+        if progress and len(prices) % progress == 0:
+            print(f"Fetch Progress: {len(prices)}/{len(symbols)} symbols")
+
+    return prices, volumes
+
+
+# Blocking entry point returning ({symbol: price}, {symbol: volume}) for every requested symbol
+def fetch_quotes(symbols, progress=50, **kwargs):
+    return asyncio.run(_collect_quotes(list(symbols), progress, **kwargs))
@@ -0,0 +1,121 @@
+import csv
+from queue import Queue
+from threading import Thread
+
+import numpy as np
+
+HISTORY_CHUNK_PERIODS = 256
+HISTORY_PREFETCH_CHUNKS = 2
+
+
+# Bars are long format records (time, symbol, price, volume) sorted by time, every distinct time is one period
+def _iter_csv_bars(path):
+    with open(path, "r", newline="") as f:
+        for r in csv.DictReader(f):
+            yield r["time"], r["symbol"], float(r["price"]), int(float(r["volume"]))
+
+
+def _iter_parquet_bars(path, batch_size=65536):
+    # Imported on demand, pyarrow is only required when replaying parquet files
+    import pyarrow.parquet as pq
+
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=["time", "symbol", "price", "volume"]):
+        columns = batch.to_pydict()
+        yield from zip(columns["time"], columns["symbol"], columns["price"], columns["volume"])
+
+
+def iter_bars(path):
+    return _iter_parquet_bars(path) if path.endswith(".parquet") else _iter_csv_bars(path)
+
+
+# Groups the bar stream into (chunk_periods x symbol) blocks, symbols without a bar in a period keep their previous value
+def iter_bar_chunks(path, registry, init_prices, init_volumes, chunk_periods=HISTORY_CHUNK_PERIODS):
+    price_row = np.array(init_prices, dtype=np.float64)
+    volume_row = np.array(init_volumes, dtype=np.int64)
+
+    prices = np.empty((chunk_periods, len(registry)), dtype=np.float64)
+    volumes = np.empty((chunk_periods, len(registry)), dtype=np.int64)
+    count = 0
+    current_time = None
+
+    for t, s, price, volume in iter_bars(path):
+        if t != current_time:
+            if current_time is not None:
+                prices[count] = price_row
+                volumes[count] = volume_row
+                count += 1
+
+                if count == chunk_periods:
+                    yield prices, volumes
+                    prices = np.empty_like(prices)
+                    volumes = np.empty_like(volumes)
+                    count = 0
+
+            current_time = t
+
+        if s in registry:
+            i = registry.id_of(s)
+            price_row[i] = price
+            volume_row[i] = volume
+
+    if current_time is not None:
+        prices[count] = price_row
+        volumes[count] = volume_row
+        count += 1
+
+    if count:
+        yield prices[:count], volumes[:count]
+
+
+# Feeds one period row at a time while a background thread reads ahead the next chunks from disk
+class HistoricalFeed:
+
+    def __init__(self, path, registry, init_prices, init_volumes, chunk_periods=HISTORY_CHUNK_PERIODS, prefetch=HISTORY_PREFETCH_CHUNKS):
+        self.path = path
+        self.registry = registry
+        self.init_prices = init_prices
+        self.init_volumes = init_volumes
+        self.chunk_periods = chunk_periods
+
+        # Two chunks in flight double buffer the chunk currently being simulated
+        self.chunks = Queue(maxsize=max(1, prefetch))
+        self.reader = None
+        self.chunk = None
+        self.offset = 0
+        self.last_row = None
+        self.exhausted = False
+
+    # Started lazily so the reader thread lives in the process consuming the feed, threads do not survive a fork
+    def start(self):
+        if self.reader:
+            return
+
+        self.reader = Thread(target=self._read_chunks, daemon=True)
+        self.reader.start()
+
+    def _read_chunks(self):
+        try:
+            for chunk in iter_bar_chunks(self.path, self.registry, self.init_prices, self.init_volumes, self.chunk_periods):
+                self.chunks.put(chunk)
+        except Exception as e:
+            print("Failed Reading Historical Data:", e)
+        finally:
+            self.chunks.put(None)
+
+    def next_row(self):
+        self.start()
+
+        while not self.exhausted and (self.chunk is None or self.offset >= len(self.chunk[0])):
+            self.chunk = self.chunks.get()
+            self.offset = 0
+
+            if self.chunk is None:
+                print("Historical Data Exhausted, Carrying Last Period Forward")
+                self.exhausted = True
+
+        if self.exhausted:
+            return self.last_row if self.last_row else (self.init_prices, self.init_volumes)
+
+        self.last_row = (self.chunk[0][self.offset], self.chunk[1][self.offset])
+        self.offset += 1
+        return self.last_row
@@ -0,0 +1,58 @@
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+
+
+def _alloc(shape, dtype, shared):
+    if not shared:
+        return np.zeros(shape, dtype=dtype)
+
+    # Shared buffers are inherited by forked stage processes, writes are visible to every stage
+    buffer = RawArray("d" if dtype == np.float64 else "q", shape[0] * shape[1])
+    return np.frombuffer(buffer, dtype=dtype).reshape(shape)
+
+
+# Prices and volumes stored as contiguous (period x symbol id) arrays, indexed as prices[time][symbol_id]
+# With a feed, every period row is replayed from historical data instead of being generated
+class MarketData:
+    __slots__ = ['registry', 'period', 'prices', 'volumes', 'feed']
+
+    def __init__(self, registry, period, init_prices=None, init_volumes=None, shared=False, feed=None):
+        self.registry = registry
+        self.period = period
+        self.feed = feed
+
+        self.prices = _alloc((period, len(registry)), np.float64, shared)
+        self.volumes = _alloc((period, len(registry)), np.int64, shared)
+
+        # Initial data is ordered by symbol id
+        if init_prices is not None:
+            self.prices[0] = init_prices
+
+        if init_volumes is not None:
+            self.volumes[0] = init_volumes
+
+    def advance(self, time_index):
+        if self.feed:
+            self.set_row(time_index, *self.feed.next_row())
+            return
+
+        # Carry the previous period's row forward, a single contiguous copy instead of a dict rebuild
+        if time_index > 0:
+            self.prices[time_index] = self.prices[time_index - 1]
+            self.volumes[time_index] = self.volumes[time_index - 1]
+
+    # Drops the feed rows of periods already simulated, called by the process reading the feed
+    def skip_rows(self, count):
+        if self.feed:
+            for _ in range(count):
+                self.feed.next_row()
+
+    # Continues a run after period time_index from its price and volume rows
+    def resume(self, time_index, prices, volumes):
+        self.skip_rows(time_index + 1)
+        self.set_row(time_index, prices, volumes)
+
+    def set_row(self, time_index, prices, volumes):
+        self.prices[time_index] = prices
+        self.volumes[time_index] = volumes
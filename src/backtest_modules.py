@@ -1,155 +1,92 @@
 from src.backtest_utils import *
+from src.backtest_signals import SignalBatch
+from src.backtest_strategies import load_strategy
+from src.backtest_portfolio import Portfolio
+from src.backtest_book import PositionBook
+from src.backtest_rebalance import rebalance, constraints_of
+from src.backtest_stopping import evaluate_stopping
+from src.backtest_universe import UniverseMask, DEFAULT_UNIVERSE
 
 
 def calc_universe(args={}):
-    result = [s for s in fetch_symbol_list() if len(s) == 1]
-    args["universe"].append(result)
+    universe = args.get("universe_mask")
 
+    if universe is None:
+        universe = UniverseMask(args.get("universe_filter") or DEFAULT_UNIVERSE)
+        args["universe_mask"] = universe
 
-def exec_strategy(args={}):
-    time = args["time"]
-    universe = args["universe"][time]
-    prices = args["prices"]
-    volumes = args["volumes"]
-    funds = args["funds"][time]
-    shares = args["shares"][time]
-    trade_signals = args["trade_signals"][time]
-    transaction_cost = args["transaction_cost"]
+    # Market filters read the current period's rows, stages without market data only evaluate symbol filters
+    if universe.uses_market_data():
+        time = args["time"]
+        added, removed = universe.update(fetch_symbol_registry(), args["prices"][time], args["volumes"][time])
+    else:
+        added, removed = universe.update(fetch_symbol_registry())
 
-    balance_buffer = funds
-
-    for s in universe:
-        old_price, new_price, price_diff = fetch_symbol_price_change(time, prices, volumes, s)
-        stock_shares = shares[s] if s in shares else 0
-        volume = get_volume(time, volumes, s)
-
-        # if abs(price_diff/old_price) < 0.05:
-        #     continue
-        old_bal = balance_buffer
-
-        if new_price < old_price:
-            # Sell
-            if stock_shares > 0:
-                max_sell_out_percentage = 0.10
-                sell_out_capacity = int(max_sell_out_percentage * stock_shares)
-                sell_target = randint(0, sell_out_capacity)
-
-                if sell_target > 0 and sell_target * new_price >= transaction_cost:
-                    trade_signals.append(gen_sell_signal(s, sell_target))
-                    balance_buffer += (sell_target * new_price - transaction_cost)
-                    args["sell_count"][time] += 1
-
-            # TODO: Remove test code
-            if balance_buffer < old_bal:
-                print("Sell Error")
-        elif new_price > old_price:
-            # Buy
-            max_buy_out_percentage = 0.10
-            max_buy_out_capcity = int(max_buy_out_percentage * volume)
-            buy_capcity = int((balance_buffer - transaction_cost) / new_price)
-            buy_target = min(randint(0, max_buy_out_capcity), buy_capcity)
-
-            if buy_target > 0:
-                trade_signals.append(gen_buy_signal(s, buy_target))
-                balance_buffer -= (buy_target * new_price + transaction_cost)
-                args["buy_count"][time] += 1
-
-            # TODO: Remove test code
-            if balance_buffer > old_bal:
-                print("Buy Error")
+    # Unchanged universes share the same id array between periods instead of re-filtering the symbol list
+    args["universe"].append(universe.ids)
 
+    return added, removed
 
-def rebal_portfolio(args={}):
-    time = args["time"]
-    prices = args["prices"]
-    funds = args["funds"][time]
-    shares = args["shares"][time]
-    trade_signals = args["trade_signals"][time]
-    transaction_cost = args["transaction_cost"]
-    max_stock_percentage = args["max_stock_percentage"]
-    balance = calc_balance(time, prices, funds, shares)
 
-    def get_corresponding_signal(symbol):
-        for s in trade_signals:
-            if s.symbol == symbol:
-                return s
+# Advances the universe prices and runs the strategy on them, only the inputs the strategy declares are gathered
+def run_strategy(strategy, time, prices, volumes, universe, shares, funds, transaction_cost, replay=False, first_prices=None):
+    # Price and volume changes for the whole universe are generated in a single vectorized pass
+    old_prices, new_prices, _ = fetch_price_changes(time, prices, volumes, universe, replay, first_prices)
 
-    signals_to_remove = []
+    arrays = {"symbols": universe, "old_prices": old_prices, "prices": new_prices, "funds": funds, "transaction_cost": transaction_cost, "time": time}
 
-    for s, c in shares.items():
-        price = get_price(time, prices, s)
-        trade_signal = get_corresponding_signal(s)
-        stock_percentage = (price * c) / balance
-        post_trade_stock_percentage = stock_percentage if not trade_signal else \
-                    (price * (c + trade_signal.signal_type * trade_signal.quantity))
+    if "volumes" in strategy.inputs:
+        arrays["volumes"] = volumes[time][universe]
 
-        if stock_percentage > max_stock_percentage:
-            # Reduce Signal Quantity And Stock Quantity If Needed
+    if "positions" in strategy.inputs:
+        arrays["positions"] = np.fromiter((shares.get(s, 0) for s in universe.tolist()), dtype=np.int64, count=len(universe))
 
-            post_trade_quantity = c
+    return strategy.on_period(arrays)
 
-            if trade_signal:
-                if trade_signal.signal_type < 0:
-                    post_trade_quantity -= trade_signal.quantity
-                elif trade_signal.signal_type > 0 and post_trade_stock_percentage > max_stock_percentage:
-                    # Remove Order
-                    signals_to_remove.append(trade_signal)
 
-            post_trade_stock_percentage = (price * post_trade_quantity) / balance
-
-            if post_trade_stock_percentage > max_stock_percentage:
-                sell_target = int((post_trade_stock_percentage - max_stock_percentage) * balance / price)
+def exec_strategy(args={}):
+    time = args["time"]
+    trade_signals = run_strategy(args["strategy"], time, args["prices"], args["volumes"], args["universe"][time], args["shares"][time], args["funds"][time], args["transaction_cost"], args["replay"],
+                                 args.get("first_prices"))
 
-                if sell_target > 0:
-                    # print("Reduce Target", sell_target, "|", (price * (post_trade_quantity - sell_target)) / balance)
-                    trade_signals.append(gen_sell_signal(s, sell_target))
-                    funds += (sell_target * price - transaction_cost)
-        elif stock_percentage < max_stock_percentage:
-            # Reduce Signal Quantity If Needed
+    args["trade_signals"][time] = trade_signals
+    args["buy_count"][time] += int(np.count_nonzero(trade_signals.signal_types > 0))
+    args["sell_count"][time] += int(np.count_nonzero(trade_signals.signal_types < 0))
 
-            post_trade_quantity = c
 
-            if trade_signal and trade_signal.signal_type > 0:
-                post_trade_quantity += trade_signal.quantity
+def fetch_portfolio(args={}):
+    time = args["time"]
+    portfolio = args.get("portfolio")
 
-                post_trade_stock_percentage = (price * post_trade_quantity) / balance
+    # Created from the first period handled by this process, afterwards only re-marked at each period's prices
+    if portfolio is None:
+        portfolio = Portfolio(args["funds"][time], args["shares"][time], args["prices"][time])
+        args["portfolio"] = portfolio
+    else:
+        portfolio.mark_row(args["prices"][time])
 
-                if post_trade_stock_percentage > max_stock_percentage:
-                    # Reduce Buy Quantity
+    return portfolio
 
-                    reduce_target = int((post_trade_stock_percentage - max_stock_percentage) * balance / price)
 
-                    if trade_signal.quantity > reduce_target:
-                        # print("Reduce Target", reduce_target, "|", (price * (post_trade_quantity - reduce_target)) / balance)
-                        trade_signal.quantity -= reduce_target
-                    elif trade_signal.quantity < reduce_target:
-                        print("Error: Trade Signal Quantity is Less than Reduce Quantity")
-                    else:
-                        # Remove Order
-                        signals_to_remove.append(trade_signal)
-                        print("Removing Zero Order")
+def rebal_portfolio(args={}):
+    time = args["time"]
+    portfolio = fetch_portfolio(args)
 
-    for s in signals_to_remove:
-        trade_signals.remove(s)
+    # Signals are netted per symbol and projected onto the portfolio constraints in one pass
+    args["trade_signals"][time] = rebalance(portfolio.positions, args["trade_signals"][time], args["prices"][time], portfolio.balance(), constraints_of(args))
 
 
 def gen_order(args={}):
     time = args["time"]
     prices = args["prices"]
-    funds = args["funds"][time]
     shares = args["shares"][time]
-    trade_signals = args["trade_signals"][time]
-    transaction_cost = 6
-
-    for s in trade_signals:
-        # Lazy add symbols to shares list if they don't already exist
-        if s.symbol not in shares:
-            shares[s.symbol] = 0
+    portfolio = args["portfolio"]
+    transaction_cost = args["transaction_cost"]
 
-        shares[s.symbol] += (s.signal_type * s.quantity)
-        funds += (-s.signal_type * s.quantity * get_price(time, prices, s.symbol))
+    book = PositionBook(shares, args["trade_signals"][time])
+    portfolio.fill(book, prices[time], transaction_cost)
 
-    args["funds"][time] = funds - transaction_cost * len(trade_signals)
+    args["funds"][time] = portfolio.funds
 
 
 def calc_stats(args={}):
@@ -159,35 +96,46 @@ def calc_stats(args={}):
     shares = args["shares"][time]
     buy_count = args["buy_count"][time]
     sell_count = args["sell_count"][time]
-    balance = calc_balance(args["time"], args["prices"], funds, shares)
+    balance = args["portfolio"].balance()
     net = balance - initial_funds
 
     # Storing Prices of Bought Shares to Supply Price Reference for RabbitMQ Execution Mode Calc Balance Computation
-    price_data = args["prices"]
+    # Collected as each period completes so a resumed run holds them without the earlier price rows
+    share_prices = args.setdefault("share_prices", list())
+    share_prices.append({s: args["prices"][time][s] for s in shares.keys()})
 
-    prices = []
+    # Stored only for the last period, for both sync and rabbitmq to equal io write work
+    prices = share_prices if time == args["period"] - 1 else []
 
-    # Storing only counted for last period and counted for both sync and rabbitmq to equal io write work
-    if time == args["period"] - 1:
-        for i in range(len(args["prices"])):
-            period_share_prices = dict()
+    args["statistics"].append(
+        {"time": time, "initial_funds": initial_funds, "funds": funds, "shares": shares, "balance": balance, "net": net,
+         "buy_count": buy_count, "sell_count": sell_count, "prices": prices})
 
-            period_shares = args["shares"][i]
 
-            for s, _ in period_shares.items():
-                period_share_prices[s] = price_data[i][s]
+def check_stop(args={}):
+    policies = args.get("stopping_policies")
 
-            prices.append(period_share_prices)
+    if not policies:
+        return None
 
-    args["statistics"].append(
-        {"time": time, "initial_funds": initial_funds, "funds": funds, "shares": shares, "balance": balance, "net": net,
-         "buy_count": buy_count, "sell_count": sell_count, "prices": prices})
+    if "stopping_state" not in args:
+        args["stopping_state"] = {"run_key": args.get("run_key", (args.get("user_id"), args.get("strategy_id"), args.get("backtest_id")))}
+
+    # The reason is stored on the period's statistics record before it is pushed, so the partial results are marked
+    args["pruned"] = evaluate_stopping(policies, args["statistics"][-1], args["stopping_state"])
+    return args["pruned"]
 
 
 def push_data(args={}):
-    user_id = args["user_id"]
-    strategy_id = args["strategy_id"]
-    backtest_id = args["backtest_id"]
-    statistics = args["statistics"]
+    writer = args.get("result_writer")
+
+    if writer is None:
+        writer = ResultWriter(args["user_id"], args["strategy_id"], args["backtest_id"], flush_interval=args.get("flush_interval", 100), fsync_policy=args.get("fsync_policy", FSYNC_ON_FLUSH),
+                              mode=args.get("result_mode", "overwrite"))
+        args["result_writer"] = writer
+
+    # Only the current period's record is written, previous periods are already on disk
+    writer.write(args["statistics"][-1])
 
-    save_data(user_id, strategy_id, backtest_id, statistics)
+    if args["time"] == args["period"] - 1 or args.get("pruned"):
+        writer.close()
@@ -0,0 +1,116 @@
+import numpy as np
+
+import src.backtest_utils as backtest_utils
+from src.backtest_rebalance import ConcentrationCap
+from src.backtest_strategies import load_strategy
+from src.backtest_universe import UniverseMask, DEFAULT_UNIVERSE, UNIVERSE_STATIC
+
+MC_QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+SPLITMIX_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _quantiles(values, quantiles):
+    return dict(zip(quantiles, np.quantile(values, quantiles).tolist()))
+
+
+# Noise z coordinate of every path, drawn from a generator of the path's own seed
+# The noise lattice wraps every 256 units, integer seeds 256 apart would otherwise share their noise
+def _noise_offsets(seeds):
+    return np.array([np.random.default_rng(s).uniform(0, 256) for s in seeds.tolist()], dtype=np.float64)
+
+
+def _splitmix(x):
+    x = x + SPLITMIX_GAMMA
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+# Counter based random streams, one per (path x symbol) row, drawn together in one vectorized pass
+# A path's numbers only depend on its seed and the draw count, never on the other paths of the batch
+# Implements the integers call of numpy generators the price, volume and strategy kernels draw with
+class PathStreams:
+    __slots__ = ['keys', 'draws']
+
+    def __init__(self, seeds):
+        self.keys = np.array([np.random.SeedSequence(s).generate_state(1, np.uint64)[0] for s in seeds.tolist()], dtype=np.uint64)[:, None]
+        self.draws = 0
+
+    def integers(self, low, high, endpoint=False):
+        low, high = np.broadcast_arrays(np.asarray(low, dtype=np.int64), np.asarray(high, dtype=np.int64))
+        span = high - low + (1 if endpoint else 0)
+
+        if (span <= 0).any():
+            raise ValueError("low >= high")
+
+        # Every draw gets its own block of counters, one counter per symbol column
+        counters = np.arange(self.draws * low.shape[-1], (self.draws + 1) * low.shape[-1], dtype=np.uint64)
+        self.draws += 1
+
+        with np.errstate(over="ignore"):
+            bits = _splitmix(_splitmix(self.keys ^ counters * SPLITMIX_GAMMA))
+
+        return low + (bits % span.astype(np.uint64)).astype(np.int64)
+
+
+# Simulates one path per seed as (path x symbol) rows stepped through every period together
+# Each path draws its noise z coordinate and its shocks from streams of its own seed, a path's outcome does not depend on the batch it ran in
+# Only the static part of the universe definition is applied, every path trades the same symbols
+def run_monte_carlo(strategy_id, paths=1000, period=365, seeds=None, universe_filter=None, initial_funds=10000, transaction_cost=6, max_stock_percentage=0.20, strategy=None, quantiles=MC_QUANTILES):
+    seeds = np.arange(paths) + int(backtest_utils.seed) if seeds is None else np.asarray(seeds, dtype=np.int64)
+
+    if period < 1 or not len(seeds):
+        raise ValueError("Monte Carlo runs need at least one period and one path: period {}, paths {}".format(period, len(seeds)))
+
+    strategy = strategy or load_strategy(strategy_id)
+    generator = PathStreams(seeds)
+
+    init_prices, init_volumes = backtest_utils.assure_init_data()
+    registry = backtest_utils.fetch_symbol_registry()
+    universe_mask = UniverseMask(universe_filter or DEFAULT_UNIVERSE, UNIVERSE_STATIC)
+    universe_mask.update(registry)
+    universe = universe_mask.ids
+
+    prices = np.tile(np.asarray(init_prices, dtype=np.float64)[universe], (len(seeds), 1))
+    volumes = np.tile(np.asarray(init_volumes, dtype=np.int64)[universe], (len(seeds), 1))
+    positions = np.zeros(prices.shape, dtype=np.int64)
+    funds = np.full(len(seeds), initial_funds, dtype=np.float64)
+    noise_seeds = _noise_offsets(seeds)[:, None]
+    constraints = [ConcentrationCap(max_stock_percentage)]
+
+    balances = np.empty((len(seeds), period), dtype=np.float64)
+    buy_counts = np.zeros(len(seeds), dtype=np.int64)
+    sell_counts = np.zeros(len(seeds), dtype=np.int64)
+
+    for p in range(period):
+        old_prices = prices
+        prices = backtest_utils.gen_prices(p, universe, old_prices, noise_seeds, generator)
+        volumes = backtest_utils.gen_volumes(old_prices, prices, volumes, generator)
+
+        arrays = {"symbols": universe, "old_prices": old_prices, "prices": prices, "volumes": volumes, "positions": positions, "funds": funds,
+                  "transaction_cost": transaction_cost, "time": p, "generator": generator}
+        signal_types, quantities = strategy.on_paths(arrays)
+
+        buy_counts += np.count_nonzero(signal_types > 0, axis=1)
+        sell_counts += np.count_nonzero(signal_types < 0, axis=1)
+
+        # Rebalance and fill every path at once, each path holds one net signal per symbol
+        net_quantities = signal_types * quantities
+        balance = funds + np.sum(positions * prices, axis=1)
+
+        for c in constraints:
+            net_quantities = c.project(positions, net_quantities, prices, balance[:, None])
+
+        positions += net_quantities
+        funds -= np.sum(net_quantities * prices, axis=1) + transaction_cost * np.count_nonzero(net_quantities, axis=1)
+        balances[:, p] = funds + np.sum(positions * prices, axis=1)
+
+    terminal_balances = balances[:, -1]
+    max_drawdowns = np.max(1 - balances / np.maximum.accumulate(balances, axis=1), axis=1)
+
+    return {"paths": len(seeds), "period": period, "seeds": seeds.tolist(), "initial_funds": initial_funds,
+            "terminal_balances": terminal_balances, "max_drawdowns": max_drawdowns, "buy_counts": buy_counts, "sell_counts": sell_counts,
+            "terminal_balance_mean": float(terminal_balances.mean()), "terminal_balance_std": float(terminal_balances.std()),
+            "terminal_balance_quantiles": _quantiles(terminal_balances, quantiles), "max_drawdown_quantiles": _quantiles(max_drawdowns, quantiles),
+            "loss_probability": float(np.mean(terminal_balances < initial_funds))}
@@ -1,19 +1,30 @@
-from multiprocessing import Manager
-from collections import defaultdict
-from copy import deepcopy
+from multiprocessing import Pipe
+from multiprocessing.connection import wait
 
 from src.backtest_utils import *
+from src.backtest_modules import run_strategy, rebal_portfolio, gen_order, calc_stats, check_stop, push_data
+from src.backtest_strategies import load_strategy
+from src.backtest_market_data import MarketData
+from src.backtest_shared_state import SharedRunState, HEADER_STAGE_A_TIME, HEADER_STAGE_B_TIME, HEADER_STAGE_C_TIME, HEADER_BUY_COUNT, HEADER_SELL_COUNT, HEADER_PRUNED, HEADER_FAILED
+from src.backtest_history import HistoricalFeed
+from src.backtest_checkpoint import CHECKPOINT_INTERVAL, push_checkpoint, restore_args, rewind_results, start_checkpoints, run_identity
+from src.backtest_universe import UniverseMask, DEFAULT_UNIVERSE, UNIVERSE_STATIC, UNIVERSE_MARKET
 from src.timer import Timer
 
 
 class BackTest(Process):
 
-    def __init__(self, user_id, strategy_id, backtest_id, period=365):
+    def __init__(self, user_id, strategy_id, backtest_id, period=365, data_source=None, universe_filter=None, strategy=None, stopping_policies=None, checkpoint_interval=CHECKPOINT_INTERVAL, checkpoint=None):
         self.user_id = user_id
         self.strategy_id = strategy_id
         self.backtest_id = backtest_id
         self.period = period
-        self._manager = Manager()
+        self.data_source = data_source            # Historical bar file replayed instead of generated prices
+        self.universe_filter = universe_filter    # Universe definition, see compile_universe
+        self.strategy = strategy                  # Strategy object, loaded from the strategy registry by strategy_id when not given
+        self.stopping_policies = stopping_policies    # Policies ending the run early, see backtest_stopping
+        self.checkpoint_interval = checkpoint_interval    # Periods between checkpoints, 0 disables them
+        self.checkpoint = checkpoint              # Checkpoint state the run resumes from, see backtest_checkpoint
 
         super().__init__(target=self.run_backtest, args=())
 
@@ -36,333 +47,282 @@ class BackTest(Process):
         initial_funds = 10000
 
         # Fetches and caches historical price data
-        data = assure_init_data(self._manager)
-
-        # Must Convert Prices and volumes Lists to Managed Lists to Ensure Appends Are Persistent
-        prices = self._manager.list()
-        volumes = self._manager.list()
-
-        # Must occur before prices and volumes declaration in manager to allow these to be static and synced from host process to all child processes
-        for i in range(self.period):
-
-            new_prices = self._manager.dict()
-            new_volumes = self._manager.dict()
-
-            if i == 0:
-                for k, v in data[0][i].items():
-                    new_prices[k] = v
-
-                for k, v in data[1][i].items():
-                    new_volumes[k] = v
-            else:
-                for k, v in prices[i - 1].items():
-                    new_prices[k] = v
-
-                for k, v in volumes[i - 1].items():
-                    new_volumes[k] = v
-
-            prices.append(new_prices)
-            volumes.append(new_volumes)
-
-        # Must use manager to ensure all values are shallow-synced
-        kwargs = self._manager.dict()
-
-        kwargs["user_id"] = self.user_id                    # Static
-        kwargs["strategy_id"] = self.strategy_id            # Static
-        kwargs["backtest_id"] = self.backtest_id            # Static
-        kwargs["period"] = self.period                      # Static
-        kwargs["stage_a_time"] = 0                          # Dynamic
-        kwargs["stage_b_time"] = 0                          # Dynamic
-        kwargs["stage_c_time"] = 0                          # Dynamic
-        kwargs["universe"] = self._manager.list()           # Dynamic
-        kwargs["shares"] = self._manager.dict()             # Dynamic
-        kwargs["prices"] = prices                           # Static
-        kwargs["volumes"] = volumes                         # Static
-        kwargs["trade_signals"] = self._manager.Queue()     # Dynamic
-        kwargs["statistics"] = self._manager.list()         # Dynamic
-        kwargs["buy_count"] = 0                             # Dynamic
-        kwargs["sell_count"] = 0                            # Dynamic
-        kwargs["initial_funds"] = initial_funds             # Static
-        kwargs["funds"] = initial_funds                     # Dynamic
-        kwargs["transaction_cost"] = 6                      # Static
-        kwargs["max_stock_percentage"] = 0.20               # Static
+        data = assure_init_data()
+
+        # Must be allocated in shared buffers before the stage processes are started so every stage reads and writes the same arrays
+        registry = fetch_symbol_registry()
+        feed = HistoricalFeed(self.data_source, registry, data[0], data[1]) if self.data_source else None
+        market_data = MarketData(registry, self.period, data[0], data[1], shared=True, feed=feed)
+
+        # Static settings, copied into every stage when it is forked
+        settings = dict()
+
+        settings["user_id"] = self.user_id
+        settings["strategy_id"] = self.strategy_id
+        settings["backtest_id"] = self.backtest_id
+        settings["period"] = self.period
+        settings["initial_funds"] = initial_funds
+        settings["transaction_cost"] = 6
+        settings["replay"] = feed is not None
+        settings["first_prices"] = np.asarray(data[0], dtype=np.float64)    # Replayed period 0 is compared against the initial snapshot
+        settings["universe_filter"] = self.universe_filter
+        settings["max_stock_percentage"] = 0.20
+        settings["flush_interval"] = 100
+        settings["fsync_policy"] = FSYNC_ON_FLUSH
+        settings["data_source"] = self.data_source
+        settings["strategy"] = self.strategy
+        settings["stopping_policies"] = self.stopping_policies
+        settings["checkpoint_interval"] = self.checkpoint_interval
+        settings["checkpoint"] = self.checkpoint
+        settings["start_time"] = 0
+
+        # A resumed run continues every stage after the checkpoint's period, the checkpoint's settings replace the defaults
+        # Stage b skips the replayed rows itself, the feed is read by the process consuming it
+        if self.checkpoint:
+            config = self.checkpoint["config"]
+            settings.update({k: config[k] for k in ("initial_funds", "transaction_cost", "max_stock_percentage", "flush_interval", "fsync_policy", "run")})
+            settings["start_time"] = self.checkpoint["time"] + 1
+            market_data.set_row(self.checkpoint["time"], self.checkpoint["prices"], self.checkpoint["volumes"])
+            rewind_results(settings, self.checkpoint)
+            print("Resuming at Period:", settings["start_time"])
+        else:
+            # Checkpoints left under these ids belong to an earlier run and would rewind this run's results on resume
+            settings["run"] = start_checkpoints(self.user_id, self.strategy_id, self.backtest_id, run_identity())
+
+        initial_funds = settings["initial_funds"]
+        state = SharedRunState(self.period, len(registry), initial_funds)
+
+        if self.checkpoint:
+            state.funds[0] = self.checkpoint["funds"]
+            state.positions[list(self.checkpoint["shares"].keys())] = list(self.checkpoint["shares"].values())
+            state.header[[HEADER_STAGE_A_TIME, HEADER_STAGE_B_TIME, HEADER_STAGE_C_TIME]] = settings["start_time"]
+
+        # Stage b draws from the random streams, it hands their state to stage c with every checkpointed period
+        rng_reader, rng_writer = Pipe(duplex=False)
 
         print("Running Period:", self.period)
 
         ts[6].start()
 
-        stage_a_proc = Process(target=self.stage_a, args=(kwargs,))
-        stage_b_proc = Process(target=self.stage_b, args=(kwargs,))
-        stage_c_proc = Process(target=self.stage_c, args=(kwargs,))
+        stages = [Process(target=self.stage_a, args=(state, settings)),
+                  Process(target=self.stage_b, args=(state, settings, market_data, self.strategy, rng_writer)),
+                  Process(target=self.stage_c, args=(state, settings, market_data, self.stopping_policies, rng_reader))]
 
-        stage_a_proc.start()
-        stage_b_proc.start()
-        stage_c_proc.start()
+        try:
+            for stage in stages:
+                stage.start()
+
+            # A stage exiting abnormally, e.g. killed, is marked failed so the stages waiting on it stop as well
+            running = {stage.sentinel: stage for stage in stages}
+
+            while running:
+                for sentinel in wait(list(running.keys())):
+                    stage = running.pop(sentinel)
+                    stage.join()
+
+                    if stage.exitcode:
+                        state.fail()
 
-        stage_a_proc.join()
-        stage_b_proc.join()
-        stage_c_proc.join()
+            ts[6].end()
 
-        ts[6].end()
+            # Raised so a scheduled job is reported as failed, the stage's own traceback was printed when it exited
+            if state.header[HEADER_FAILED]:
+                print("-----Failed Backtest:", "|", self.user_id, self.strategy_id, self.backtest_id, "|-----")
+                raise RuntimeError("Backtest stage failed: {} {} {}".format(self.user_id, self.strategy_id, self.backtest_id))
 
-        print("-----Finished Backtest:", "|", self.user_id, self.strategy_id, self.backtest_id, "|-----")
-        print("Module Time Taken:\n\tcalc_universe: {calc_universe}s\n\texec_strategy: {exec_strategy}s\n\trebal_portpolio: {rebal_portfolio}s\n\tgen_order: {gen_order}s\n\tcalc_stats: {calc_stats}s\n\tpush_data: {push_data}s\n\tTotal: {total}s".format(calc_universe=ts[0].get(), exec_strategy=ts[1].get(), rebal_portfolio=ts[2].get(), gen_order=ts[3].get(), calc_stats=ts[4].get(), push_data=ts[5].get(), total=ts[6].get()))
+            print("-----Finished Backtest:", "|", self.user_id, self.strategy_id, self.backtest_id, "|-----")
+            print("Module Time Taken:\n\tcalc_universe: {calc_universe}s\n\texec_strategy: {exec_strategy}s\n\trebal_portpolio: {rebal_portfolio}s\n\tgen_order: {gen_order}s\n\tcalc_stats: {calc_stats}s\n\tpush_data: {push_data}s\n\tTotal: {total}s".format(calc_universe=ts[0].get(), exec_strategy=ts[1].get(), rebal_portfolio=ts[2].get(), gen_order=ts[3].get(), calc_stats=ts[4].get(), push_data=ts[5].get(), total=ts[6].get()))
 
-        final_funds = kwargs["funds"]
-        final_shares = kwargs["shares"]
-        final_balance = calc_balance(kwargs["period"] - 1, kwargs["prices"], final_funds, final_shares)
-        net = final_balance - initial_funds
+            final_funds = float(state.funds[0])
+            final_shares = state.holdings()
+            final_balance = calc_balance(state.header[HEADER_STAGE_C_TIME] - 1, market_data.prices, final_funds, final_shares)
+            net = final_balance - initial_funds
 
-        print("Initial Balance:", initial_funds)
-        print("Remaining Funds:", final_funds)
-        print("Final Balance:", final_balance)
-        print("Net:", net)
-        print("Final Shares:", final_shares)
+            print("Initial Balance:", initial_funds)
+            print("Remaining Funds:", final_funds)
+            print("Final Balance:", final_balance)
+            print("Net:", net)
+            print("Final Shares:", {market_data.registry.symbol_of(s): c for s, c in final_shares.items()})
+        finally:
+            state.close()
 
-    def stage_a(self, kwargs):
+    def stage_a(self, state, settings):
         try:
-            period = kwargs["period"]
-            stage_a_time = kwargs["stage_a_time"]
+            period = settings["period"]
+            stage_a_time = settings["start_time"]
 
-            while stage_a_time < period:
+            # Stage a has no market data for future periods, market filters are applied by stage b
+            universe = UniverseMask(settings["universe_filter"] or DEFAULT_UNIVERSE, UNIVERSE_STATIC)
+
+            while stage_a_time < period and not state.stopped():
                 # Start Universe Calculation for Each Period
-                self.calc_universe(kwargs)
+                self.calc_universe(state, universe, stage_a_time, settings["start_time"])
 
                 stage_a_time += 1
-                kwargs["stage_a_time"] = stage_a_time
+                state.header[HEADER_STAGE_A_TIME] = stage_a_time
+                state.universe_ready.release()
         except KeyboardInterrupt:
             quit(0)
+        except Exception:
+            state.fail()
+            raise
 
         print("Completed Stage A")
 
-    def stage_b(self, kwargs):
+    def stage_b(self, state, settings, market_data, strategy=None, rng_writer=None):
         try:
-            period = kwargs["period"]
-            stage_a_time = kwargs["stage_a_time"]
-            stage_b_time = kwargs["stage_b_time"]
-            stage_c_time = kwargs["stage_c_time"]
-
-            while stage_b_time < period:
-                # Check to see if there are available universes on which to execute the strategy
-                # Check to see that previous stage c handling has been completed for the next period
-                if stage_a_time > stage_b_time and stage_b_time <= stage_c_time:
-                    # Start Strategy Execution
-                    self.exec_strategy(kwargs)
-                    stage_b_time += 1
-                    kwargs["stage_b_time"] = stage_b_time
-
-                stage_a_time = kwargs["stage_a_time"]
-                stage_c_time = kwargs["stage_c_time"]
-        except KeyboardInterrupt:
-            quit(0)
+            period = settings["period"]
+            start_time = settings["start_time"]
+            stage_b_time = start_time
+            market_universe = UniverseMask(settings["universe_filter"] or DEFAULT_UNIVERSE, UNIVERSE_MARKET)
+            header = state.header
 
-        print("Completed Stage B")
+            # Only the stage executing the strategy imports it
+            strategy = strategy or load_strategy(settings["strategy_id"])
 
-    def stage_c(self, kwargs):
-        try:
-            period = kwargs["period"]
-            stage_b_time = kwargs["stage_b_time"]
-            stage_c_time = kwargs["stage_c_time"]
+            if settings["checkpoint"]:
+                market_data.skip_rows(start_time)
+                set_rng_state(settings["checkpoint"]["rng"])
 
-            while stage_c_time < period:
-                if stage_c_time < stage_b_time:
-                    # Start Portfolio Rebalancing
-                    self.rebal_portfolio(kwargs)
+            while stage_b_time < period:
+                # Wait for the period's universe and for stage c to finish the previous period
+                state.universe_ready.acquire()
 
-                    # Start Generating Orders
-                    self.gen_order(kwargs)
+                if stage_b_time > start_time:
+                    state.period_done.acquire()
 
-                    # Start Statistics Calculation
-                    self.calc_stats(kwargs)
+                if state.stopped():
+                    break
 
-                    # Start Pushing Data
-                    self.push_data(kwargs)
+                # Start Strategy Execution
+                market_data.advance(stage_b_time)
+                self.exec_strategy(state, settings, market_data, market_universe, strategy, stage_b_time)
 
-                    stage_c_time += 1
-                    kwargs["stage_c_time"] = stage_c_time
+                # Sent before the signals, stage c takes the period's checkpoint with the streams as they were after it
+                if self.checkpoint_due(settings, stage_b_time):
+                    rng_writer.send(get_rng_state())
 
-                stage_b_time = kwargs["stage_b_time"]
+                stage_b_time += 1
+                header[HEADER_STAGE_B_TIME] = stage_b_time
+                state.signals_ready.release()
         except KeyboardInterrupt:
             quit(0)
+        except Exception:
+            state.fail()
+            raise
 
-        print("Completed Stage C")
+        print("Completed Stage B")
 
-    @staticmethod
-    def calc_universe(kwargs={}):
-        result = [s for s in fetch_symbol_list() if len(s) == 1]
-        kwargs["universe"].append(result)
+    # Stage c runs the same modules as the synchronous engine on its own args, the results are written by push_data
+    def stage_c(self, state, settings, market_data, stopping_policies=None, rng_reader=None):
+        args = dict(settings)
 
-    @staticmethod
-    def exec_strategy(kwargs={}):
-        time = kwargs["stage_b_time"]
-        universe = kwargs["universe"][time]
-        prices = kwargs["prices"]
-        volumes = kwargs["volumes"]
-        funds = kwargs["funds"]
-        shares = kwargs["shares"]
-        transaction_cost = kwargs["transaction_cost"]
-        trade_signals = kwargs["trade_signals"]
-
-        balance_buffer = funds
-
-        for s in universe:
-            old_price, new_price, price_diff = fetch_symbol_price_change(time, prices, volumes, s)
-            stock_shares = shares[s] if s in shares else 0
-            volume = get_volume(time, volumes, s)
-
-            # if abs(price_diff/old_price) < 0.05:
-            #     continue
-            old_bal = balance_buffer
-
-            if new_price < old_price:
-                # Sell
-                if stock_shares > 0:
-                    max_sell_out_percentage = 0.10
-                    sell_out_capacity = int(max_sell_out_percentage * stock_shares)
-                    sell_target = randint(0, sell_out_capacity)
-
-                    if sell_target > 0 and sell_target * new_price >= transaction_cost:
-                        trade_signals.append(gen_sell_signal(s, sell_target))
-                        balance_buffer += (sell_target * new_price - transaction_cost)
-                        kwargs["sell_count"] += 1
-
-                # TODO: Remove test code
-                if balance_buffer < old_bal:
-                    print("Sell Error")
-            elif new_price > old_price:
-                # Buy
-                max_buy_out_percentage = 0.10
-                max_buy_out_capcity = int(max_buy_out_percentage * volume)
-                buy_capcity = int((balance_buffer - transaction_cost) / new_price)
-                buy_target = min(randint(0, max_buy_out_capcity), buy_capcity)
-
-                if buy_target > 0:
-                    trade_signals.append(gen_buy_signal(s, buy_target))
-                    balance_buffer -= (buy_target * new_price + transaction_cost)
-                    kwargs["buy_count"] += 1
-
-                # TODO: Remove test code
-                if balance_buffer > old_bal:
-                    print("Buy Error")
+        try:
+            period = settings["period"]
+            stage_c_time = settings["start_time"]
+            header = state.header
+
+            args["prices"] = market_data.prices
+            args["volumes"] = market_data.volumes
+            args["funds"] = list()
+            args["shares"] = list()
+            args["buy_count"] = list()
+            args["sell_count"] = list()
+            args["trade_signals"] = list()
+            args["statistics"] = list()
+            args["stopping_policies"] = stopping_policies
+
+            if settings["checkpoint"]:
+                restore_args(args, settings["checkpoint"])
 
-    @staticmethod
-    def _get_corresponding_signal(trade_signals, symbol):
-        for ts in trade_signals:
-            if ts.symbol == symbol:
-                return ts
+            while stage_c_time < period:
+                # Wait for stage b to publish the period's signals
+                state.signals_ready.acquire()
 
-    @staticmethod
-    def rebal_portfolio(kwargs={}):
-        time = kwargs["stage_c_time"]
-        prices = kwargs["prices"]
-        funds = kwargs["funds"]
-        shares = kwargs["shares"]
-        trade_signals = kwargs["trade_signals"]
-        transaction_cost = kwargs["transaction_cost"]
-        max_stock_percentage = kwargs["max_stock_percentage"]
-        balance = calc_balance(time, prices, funds, shares)
+                if header[HEADER_FAILED]:
+                    break
 
-        signals_to_remove = []
+                self.take_period(state, args, stage_c_time)
 
-        for s, c in shares.items():
-            price = get_price(time, prices, s)
-            trade_signal = BackTest._get_corresponding_signal(trade_signals, s)
-            stock_percentage = (price * c) / balance
-            post_trade_stock_percentage = stock_percentage if not trade_signal else (price * (c + trade_signal.signal_type * trade_signal.quantity))
+                # Start Portfolio Rebalancing
+                rebal_portfolio(args)
 
-            if stock_percentage > max_stock_percentage:
-                # Reduce Signal Quantity And Stock Quantity If Needed
-                post_trade_quantity = c
+                # Start Generating Orders
+                gen_order(args)
 
-                if trade_signal:
-                    if trade_signal.signal_type < 0:
-                        post_trade_quantity -= trade_signal.quantity
-                    elif trade_signal.signal_type > 0 and post_trade_stock_percentage > max_stock_percentage:
-                        # Remove Order
-                        signals_to_remove.append(trade_signal)
+                # Start Statistics Calculation
+                calc_stats(args)
+                check_stop(args)
 
-                post_trade_stock_percentage = (price * post_trade_quantity) / balance
+                # Start Pushing Data
+                push_data(args)
 
-                if post_trade_stock_percentage > max_stock_percentage:
-                    sell_target = int((post_trade_stock_percentage - max_stock_percentage) * balance / price)
+                # Snapshots the completed period, the last period and pruned runs need no resuming
+                if self.checkpoint_due(settings, stage_c_time):
+                    rng = rng_reader.recv()
 
-                    # print("Reduce Target", sell_target, "|", (price * (post_trade_quantity - sell_target)) / balance)
-                    trade_signals.append(gen_sell_signal(s, sell_target))
-                    funds += (sell_target * price - transaction_cost)
-            elif stock_percentage < max_stock_percentage:
-                # Reduce Signal Quantity If Needed
+                    if not args.get("pruned"):
+                        push_checkpoint(args, rng)
 
-                post_trade_quantity = c
+                # Funds, positions and the pruned flag are published before the period is released to stage b
+                state.funds[0] = args["funds"][stage_c_time]
+                state.positions[:] = args["portfolio"].positions
 
-                if trade_signal and trade_signal.signal_type > 0:
-                    post_trade_quantity += trade_signal.quantity
+                if args.get("pruned"):
+                    header[HEADER_PRUNED] = 1
 
-                    post_trade_stock_percentage = (price * post_trade_quantity) / balance
+                stage_c_time += 1
+                header[HEADER_STAGE_C_TIME] = stage_c_time
+                state.period_done.release()
 
-                    if post_trade_stock_percentage > max_stock_percentage:
-                        # Reduce Buy Quantity
+                if args.get("pruned"):
+                    state.wake()
+                    print("Pruned at Period:", stage_c_time - 1, "|", args["pruned"])
+                    break
+        except KeyboardInterrupt:
+            quit(0)
+        except Exception:
+            state.fail()
+            raise
+        finally:
+            if "result_writer" in args:
+                args["result_writer"].close()
 
-                        reduce_target = int((post_trade_stock_percentage - max_stock_percentage) * balance / price)
+        print("Completed Stage C")
 
-                        # print("Reduce Target", reduce_target, "|", (price * (post_trade_quantity - reduce_target)) / balance)
-                        trade_signal.quantity -= reduce_target
+    @staticmethod
+    def calc_universe(state, universe=None, time=0, start_time=0):
+        added, removed = universe.update(fetch_symbol_registry())
 
-        # for s in signals_to_remove:
-        #     for i in range(len(trade_signals) - 1, -1, -1):
-        #         ts = trade_signals[i]
-        #
-        #         if ts.symbol == s.symbol:
-        #             trade_signals.remove(i)
+        # Rows are only written when the universe changed, later periods refer back to the row of the last change
+        state.set_universe(time, universe.mask if time == start_time or len(added) or len(removed) else None)
 
     @staticmethod
-    def gen_order(kwargs={}):
-        time = kwargs["stage_c_time"]
-        prices = kwargs["prices"]
-        funds = kwargs["funds"]
-        shares = kwargs["shares"]
-        trade_signals = kwargs["trade_signals"]
-        transaction_cost = 6
+    def checkpoint_due(settings, time):
+        interval = settings["checkpoint_interval"]
+        return bool(interval) and (time + 1) % interval == 0 and time + 1 < settings["period"]
 
-        for s in trade_signals:
-            # Lazy add symbols to shares list if they don't already exist
-            if s.symbol not in shares:
-                shares[s.symbol] = 0
+    @staticmethod
+    def exec_strategy(state, settings, market_data, market_universe, strategy, time):
+        universe = np.flatnonzero(state.universe_row(time))
+        prices = market_data.prices
+        volumes = market_data.volumes
 
-            shares[s.symbol] += (s.signal_type * s.quantity)
-            funds += (-s.signal_type * s.quantity * get_price(time, prices, s.symbol))
+        if market_universe.uses_market_data():
+            universe = market_universe.restrict(market_data.registry, universe, prices[time], volumes[time])
 
-        kwargs["funds"] = funds - transaction_cost * len(trade_signals)
+        trade_signals = run_strategy(strategy, time, prices, volumes, universe, state.holdings(), float(state.funds[0]), settings["transaction_cost"], settings["replay"],
+                                     settings["first_prices"])
 
-    @staticmethod
-    def calc_stats(kwargs={}):
-        time = kwargs["stage_c_time"]
-        initial_funds = kwargs["initial_funds"]
-        funds = kwargs["funds"]
-        shares = kwargs["shares"]
-        buy_count = kwargs["buy_count"]
-        sell_count = kwargs["sell_count"]
-        balance = calc_balance(time, kwargs["prices"], funds, shares)
-        net = balance - initial_funds
-
-        kwargs["statistics"].append({"time": time, "initial_funds": initial_funds, "funds": funds, "shares": shares, "balance": balance, "net": net, "buy_count": buy_count, "sell_count": sell_count})
+        # Published once per period, stage c takes the signals out of the slot before stage b executes the next period
+        state.put_signals(trade_signals)
 
+    # Carries stage c's args to the next period and takes the period's signals and counts from stage b
     @staticmethod
-    def push_data(kwargs={}):
-        user_id = kwargs["user_id"]
-        strategy_id = kwargs["strategy_id"]
-        backtest_id = kwargs["backtest_id"]
-        statistics = kwargs["statistics"]
-
-        # data = []
-        #
-        # for s in statistics:
-        #     d = dict()
-        #
-        #     for k, v in s.items():
-        #
-        #
-        #         d[k] = v
-        #
-        #     data.append(d)
-        #
-        # save_data(user_id, strategy_id, backtest_id, [])
+    def take_period(state, args, time):
+        args["time"] = time
+        args["funds"].append(args["funds"][time - 1] if time else args["initial_funds"])
+        args["shares"].append(dict(args["shares"][time - 1]) if time else dict())
+        args["buy_count"].append(int(state.header[HEADER_BUY_COUNT]))
+        args["sell_count"].append(int(state.header[HEADER_SELL_COUNT]))
+        args["trade_signals"].append(state.take_signals())
@@ -0,0 +1,43 @@
+import numpy as np
+
+
+# Funds and the market value of every position, kept current by fills and price marks instead of revaluing all holdings
+# Positions and marked prices are dense arrays indexed by symbol id
+class Portfolio:
+    __slots__ = ['funds', 'positions', 'prices', 'market_value']
+
+    def __init__(self, funds, shares, prices):
+        self.funds = funds
+        self.positions = np.zeros(len(prices), dtype=np.int64)
+        self.prices = np.array(prices, dtype=np.float64)
+
+        for s, c in shares.items():
+            self.positions[s] = c
+
+        self.market_value = float(np.dot(self.positions, self.prices))
+
+    def balance(self):
+        return self.funds + self.market_value
+
+    # Re-marks the given symbols at their price in the row, only held symbols move the market value
+    def mark(self, ids, prices):
+        new_prices = prices[ids]
+        self.market_value += float(np.dot(self.positions[ids], new_prices - self.prices[ids]))
+        self.prices[ids] = new_prices
+
+    # Marks every symbol whose price differs from the last marked price
+    def mark_row(self, prices):
+        self.mark(np.flatnonzero(prices != self.prices), prices)
+
+    # Fills every pending signal of the book at the marked prices
+    def fill(self, book, prices, transaction_cost):
+        order_count = len(book)
+
+        if order_count:
+            symbols = np.fromiter(book.signals.keys(), dtype=np.intp, count=order_count)
+            quantities = np.fromiter(book.signals.values(), dtype=np.int64, count=order_count)
+
+            self.positions[symbols] += quantities
+            self.market_value += float(np.dot(quantities, self.prices[symbols]))
+
+        self.funds += book.fill(prices) - transaction_cost * order_count
@@ -1,20 +1,30 @@
 from src.backtest_modules import *
 from src.backtest_utils import load_data
+from src.backtest_market_data import MarketData
+from src.backtest_history import HistoricalFeed
+from src.backtest_checkpoint import start_checkpoints
+from src.backtest_universe import UniverseMask, apply_universe_delta, NO_SYMBOLS, DEFAULT_UNIVERSE, UNIVERSE_STATIC, UNIVERSE_MARKET
 from src.timer import Timer
 
-from threading import Thread
+from threading import Thread, Condition
+from multiprocessing.connection import wait
 
 import json
+import struct
 import pika
 
 
 class BackTest(Process):
 
-    def __init__(self, user_id, strategy_id, backtest_id, period=365):
+    def __init__(self, user_id, strategy_id, backtest_id, period=365, data_source=None, universe_filter=None, strategy=None, stopping_policies=None):
         self.user_id = user_id
         self.strategy_id = strategy_id
         self.backtest_id = backtest_id
         self.period = period
+        self.data_source = data_source            # Historical bar file replayed instead of generated prices
+        self.universe_filter = universe_filter    # Universe definition, see compile_universe
+        self.strategy = strategy                  # Strategy object, loaded from the strategy registry by strategy_id when not given
+        self.stopping_policies = stopping_policies    # Policies ending the run early, see backtest_stopping
 
         super().__init__(target=self.run_backtest, args=())
 
@@ -36,34 +46,11 @@ class BackTest(Process):
 
         initial_funds = 10000
 
-        # Fetches and caches historical price data
-        data = assure_init_data()
+        # Checkpoints left under these ids belong to an earlier run and would rewind this run's results on resume
+        # The engine takes no checkpoints of its own, its stages hold their state in separate processes fed by the broker
+        start_checkpoints(self.user_id, self.strategy_id, self.backtest_id)
 
-        # Must Convert Prices and volumes Lists to Managed Lists to Ensure Appends Are Persistent
-        prices = list()
-        volumes = list()
-
-        # Must occur before prices and volumes declaration in manager to allow these to be static and synced from host process to all child processes
-        for i in range(self.period):
-
-            new_prices = dict()
-            new_volumes = dict()
-
-            if i == 0:
-                for k, v in data[0][i].items():
-                    new_prices[k] = v
-
-                for k, v in data[1][i].items():
-                    new_volumes[k] = v
-            else:
-                for k, v in prices[i - 1].items():
-                    new_prices[k] = v
-
-                for k, v in volumes[i - 1].items():
-                    new_volumes[k] = v
-
-            prices.append(new_prices)
-            volumes.append(new_volumes)
+        # Price and volume data is owned by stage b, which fetches the initial data and extends it every period
 
         # Must use manager to ensure all values are shallow-synced
         args = dict()
@@ -74,7 +61,14 @@ class BackTest(Process):
         args["period"] = self.period                      # Static
         args["initial_funds"] = initial_funds             # Static
         args["transaction_cost"] = 6                      # Static
+        args["data_source"] = self.data_source            # Static
+        args["replay"] = self.data_source is not None     # Static
+        args["universe_filter"] = self.universe_filter    # Static
+        args["strategy"] = self.strategy                  # Static, stage b loads it from strategy_id when not given
+        args["stopping_policies"] = self.stopping_policies    # Static, evaluated by stage c
         args["max_stock_percentage"] = 0.20               # Static
+        args["flush_interval"] = 100                      # Static
+        args["fsync_policy"] = FSYNC_ON_FLUSH             # Static
 
         print("Running Period:", self.period)
 
@@ -93,39 +87,59 @@ class BackTest(Process):
         ts[2].start()
         stage_c_proc.start()
 
-        stage_a_proc.join()
-        ts[0].end()
+        # A stage exiting abnormally leaves the others waiting on messages it never sends, they are stopped and the run fails
+        stages = [stage_a_proc, stage_b_proc, stage_c_proc]
+        running = {stage.sentinel: stage for stage in stages}
+        failed = False
+
+        while running:
+            for sentinel in wait(list(running.keys())):
+                stage = running.pop(sentinel)
+                stage.join()
+                ts[stages.index(stage)].end()
 
-        stage_b_proc.join()
-        ts[1].end()
+                if stage.exitcode and not failed:
+                    failed = True
 
-        stage_c_proc.join()
-        ts[2].end()
+                    for other in running.values():
+                        other.terminate()
 
         ts[3].end()
 
+        # Raised so a scheduled job is reported as failed, the stage's own traceback was printed when it exited
+        if failed:
+            print("-----Failed Backtest:", "|", self.user_id, self.strategy_id, self.backtest_id, "|-----")
+            raise RuntimeError("Backtest stage failed: {} {} {}".format(self.user_id, self.strategy_id, self.backtest_id))
+
         print("-----Finished Backtest:", "|", self.user_id, self.strategy_id, self.backtest_id, "|-----")
         print("Module Time Taken:\n\tStage A:\n\t\tcalc_universe: {stage_a}s\n\tStage B:\n\t\texec_strategy: {stage_b}s\n\tStage C:\n\t\trebal_portpolio + gen_order + calc_stats + push_data: {stage_c}s\n\tTotal: {total}s\n\tAvg Time per Period: {avg_time_per_period}s".format(stage_a=ts[0].get(), stage_b=ts[1].get(), stage_c=ts[2].get(), total=ts[3].get(), avg_time_per_period=ts[3].get() / args["period"]))
 
         # Print Backtest Results Stored in file
         data = load_data(user_id=self.user_id, strategy_id=self.strategy_id, backtest_id=self.backtest_id)[-1]
+        registry = fetch_symbol_registry()
 
         total_period = args["period"]
         final_funds = data["funds"]
         final_shares = data["shares"]
-        final_balance = calc_balance(args["period"] - 1, data["prices"], final_funds, final_shares)
+        # Stored symbol ids come back as string keys on both the shares and the per period prices
+        # Prices are only stored with the last period, a pruned run reports the balance of its last record
+        final_balance = data["balance"] if data.get("pruned") else calc_balance(args["period"] - 1, data["prices"], final_funds, final_shares)
         net = final_balance - initial_funds
 
+        if data.get("pruned"):
+            print("Pruned at Period:", data["time"], "|", data["pruned"])
+
         print()
         print("Total Period:", total_period)
         print("Initial Balance:", initial_funds)
         print("Remaining Funds:", final_funds)
         print("Final Balance:", final_balance)
         print("Net:", net)
-        print("Final Shares:", final_shares)
+        print("Final Shares:", {registry.symbol_of(s): c for s, c in final_shares.items()})
 
         for s, _ in final_shares.items():
-            print(s, ":", data["prices"][args["period"] - 1][s])
+            if data["prices"]:
+                print(registry.symbol_of(s), ":", data["prices"][args["period"] - 1][s])
 
 
 STAGE_A_NAME = "STAGEA"
@@ -134,17 +148,56 @@ STAGE_C_NAME = "STAGEC"
 
 RABBIT_MQ_SERVER_IP = "localhost"
 
+# Stage b and c messages: header length, json header, then the encoded trade signal batch
+FRAME_HEADER = struct.Struct("<I")
+
+
+def pack_frame(data, trade_signals):
+    header = json.dumps(data).encode()
+    return b"".join([FRAME_HEADER.pack(len(header)), header] + trade_signals.buffers())
+
+
+def unpack_frame(body):
+    (header_size,) = FRAME_HEADER.unpack_from(body)
+    data = json.loads(body[FRAME_HEADER.size:FRAME_HEADER.size + header_size])
+    return data, SignalBatch.from_bytes(body, FRAME_HEADER.size + header_size)
+
 
 class Stage(Process):
 
     def __init__(self, args):
         self.args = args
         self.queue_prefix = "<{user_id}><{strategy_id}><{backtest_id}>".format(user_id=self.args["user_id"], strategy_id=self.args["strategy_id"], backtest_id=self.args["backtest_id"])
+        # Consumer threads hand received periods to the stage loop through ready, the loop blocks on it until its next input arrived
+        self.ready = Condition()
+        self.consumer_failed = False
         super().__init__(target=self.setup, args=())
 
     def setup(self):
         self.exec_stage()
 
+    # Applies the updates of a consumer thread and wakes the stage loop
+    def publish(self, **updates):
+        with self.ready:
+            self.args.update(updates)
+            self.ready.notify_all()
+
+    # Blocks until predicate holds, returns False when a consumer thread failed before it did
+    def wait_for_input(self, predicate):
+        with self.ready:
+            self.ready.wait_for(lambda: predicate() or self.consumer_failed)
+            return bool(predicate())
+
+    # Runs a consumer thread, a failing consumer releases the stage loop waiting on it
+    def consume(self, target):
+        try:
+            target()
+        except Exception:
+            with self.ready:
+                self.consumer_failed = True
+                self.ready.notify_all()
+            raise
+
     def exec_stage(self):
         pass
 
@@ -177,16 +230,23 @@ class StageA(Stage):
         # Create local stage a variables
         self.args["universe"] = list()
 
+        # Stage a has no market data, market filters are applied by stage b
+        self.args["universe_mask"] = UniverseMask(self.args["universe_filter"] or DEFAULT_UNIVERSE, UNIVERSE_STATIC)
+
         period = self.args["period"]
 
         for p in range(period):
             data = dict()
 
             # Start Universe Calculation for Each Period
-            calc_universe(self.args)
+            added, removed = calc_universe(self.args)
 
-            # Publish Update to Subscribers
-            data["universe"] = self.args["universe"][p]
+            # Publish only universe changes, plus the last period so subscribers know every period is covered
+            if not len(added) and not len(removed) and p < period - 1:
+                continue
+
+            data["added"] = added.tolist()
+            data["removed"] = removed.tolist()
             data["time"] = p
             self.channel.basic_publish(exchange="", routing_key=self.queue_prefix + STAGE_A_NAME, body=json.dumps(data), properties=pika.BasicProperties(delivery_mode=2,))
 
@@ -203,14 +263,18 @@ class StageB(Stage):
         self.connectionC = None
         self.channelA = None
         self.channelC = None
+        self.market_data = None
+        self.universe_mask = None
+        self.universe_ids = NO_SYMBOLS
+        self.market_universe = None
 
     def setup(self):
         print("Starting Stage B")
         try:
             # Init Arguments Used
             self.args["universe"] = list()
-            self.args["prices"] = list()
-            self.args["volumes"] = list()
+            self.universe_mask = np.zeros(len(fetch_symbol_registry()), dtype=bool)
+            self.market_universe = UniverseMask(self.args["universe_filter"] or DEFAULT_UNIVERSE, UNIVERSE_MARKET)
 
             self.args["funds"] = list()
             self.args["shares"] = list()
@@ -227,8 +291,8 @@ class StageB(Stage):
             # Naming Queue and setting Durable tag to ensure currently queued messages are guaranteed to not be lost even in the case of a RabbitMQ error or shutdown
             self.channel.queue_declare(queue=self.queue_prefix + STAGE_B_NAME, durable=True)
 
-            stage_a_coms = Thread(target=self.handle_stage_a_data, daemon=True)
-            stage_c_coms = Thread(target=self.handle_stage_c_data, daemon=True)
+            stage_a_coms = Thread(target=self.consume, args=(self.handle_stage_a_data,), daemon=True)
+            stage_c_coms = Thread(target=self.consume, args=(self.handle_stage_c_data,), daemon=True)
 
             stage_a_coms.start()
             stage_c_coms.start()
@@ -259,8 +323,17 @@ class StageB(Stage):
     def proc_stage_a_data(self, ch, method, properties, body):
         # Store data
         data = json.loads(body)
+        universe = self.args["universe"]
+
+        # Periods since the previous change keep sharing the previous universe
+        while len(universe) < data["time"]:
+            universe.append(self.universe_ids)
+
+        if data["added"] or data["removed"]:
+            apply_universe_delta(self.universe_mask, data["added"], data["removed"])
+            self.universe_ids = np.flatnonzero(self.universe_mask)
 
-        self.args["universe"].append(data["universe"])
+        universe.append(self.universe_ids)
 
         # Acknowledge request once processing is complete to ensure remaining request, currently allocated to this worker, will be processed by another worker
         ch.basic_ack(delivery_tag=method.delivery_tag)
@@ -269,7 +342,7 @@ class StageB(Stage):
         if data["time"] == self.args["period"] - 1:
             ch.stop_consuming()
 
-        self.args["stage_a_time"] = data["time"]
+        self.publish(stage_a_time=data["time"])
 
     def handle_stage_c_data(self):
         self.connectionC = pika.BlockingConnection(pika.ConnectionParameters(RABBIT_MQ_SERVER_IP))
@@ -287,19 +360,11 @@ class StageB(Stage):
     def proc_stage_c_data(self, ch, method, properties, body):
         # Store data
 
-        data = json.loads(body)
-
-        # Repack TradeSignals
-        trade_signals = []
-
-        for st, s, q in data["trade_signals"]:
-            trade_signals.append(TradeSignal(signal_type=st, symbol=s, quantity=q))
+        data, trade_signals = unpack_frame(body)
 
-        self.args["trade_signals"][data["time"]] = data["trade_signals"]
+        self.args["trade_signals"][data["time"]] = trade_signals
 
-        self.args["prices"][data["time"]] = data["prices"]
-        self.args["volumes"][data["time"]] = data["volumes"]
-        self.args["shares"][data["time"]] = data["shares"]
+        self.args["shares"][data["time"]] = unpack_shares(data["shares"])
         self.args["funds"][data["time"]] = data["funds"]
         self.args["buy_count"][data["time"]] = data["buy_count"]
         self.args["sell_count"][data["time"]] = data["sell_count"]
@@ -307,11 +372,11 @@ class StageB(Stage):
         # Acknowledge request once processing is complete to ensure remaining request, currently allocated to this worker, will be processed by another worker
         ch.basic_ack(delivery_tag=method.delivery_tag)
 
-        # End listening when all data is received
-        if data["time"] == self.args["period"] - 1:
+        # End listening when all data is received or stage c pruned the run
+        if data["time"] == self.args["period"] - 1 or data.get("pruned"):
             ch.stop_consuming()
 
-        self.args["stage_c_time"] = data["time"]
+        self.publish(stage_c_time=data["time"], pruned=data.get("pruned"))
 
     def exec_stage(self):
         # Create local stage a variables
@@ -327,87 +392,80 @@ class StageB(Stage):
 
         # Fetches and caches historical price and volume data
         historical_data = assure_init_data()
+
+        registry = fetch_symbol_registry()
+        feed = HistoricalFeed(self.args["data_source"], registry, historical_data[0], historical_data[1]) if self.args["replay"] else None
+        self.market_data = MarketData(registry, period, historical_data[0], historical_data[1], feed=feed)
+        self.args["prices"] = self.market_data.prices
+        self.args["volumes"] = self.market_data.volumes
+        self.args["first_prices"] = np.asarray(historical_data[0], dtype=np.float64)    # Replayed period 0 is compared against the initial snapshot
+
+        # Only the stage executing the strategy imports it
+        self.args["strategy"] = self.args["strategy"] or load_strategy(self.args["strategy_id"])
+
         # tm = Timer(mode=2)
         while p < period:
-            # Check to see if there are available universes on which to execute the strategy
-            # Check to see that previous stage c handling has been completed for the next period
+            # Wait until there is a universe on which to execute the strategy
+            # and the previous period's stage c handling has been completed
+            if not self.wait_for_input(lambda: self.args.get("pruned") or (self.args["stage_c_time"] == p - 1 and p <= self.args["stage_a_time"])):
+                raise RuntimeError("Stage B Input Lost")
+
+            if self.args.get("pruned"):
+                break
 
             self.args["time"] = p
 
-            new_prices = dict()
-            new_volumes = dict()
             new_shares = dict()
 
-            if self.args["stage_c_time"] == p - 1 and p <= self.args["stage_a_time"]:
-                # print(self.args["stage_a_time"], p, self.args["stage_c_time"])
-                # Copying previous period's Price and Volume Data
-
-                if p % 100 == 0:
-                    print(p)
-
-                if p == 0:
-                    for k, v in historical_data[0][p].items():
-                        new_prices[k] = v
-
-                    for k, v in historical_data[1][p].items():
-                        new_volumes[k] = v
+            # print(self.args["stage_a_time"], p, self.args["stage_c_time"])
+            # Copying previous period's Price and Volume Data
 
-                    self.args["funds"].append(self.args["initial_funds"])
-                else:
-                    # for k, v in self.args["prices"][p - 1].items():
-                    #     new_prices[k] = v
-                    #
-                    # for k, v in self.args["volumes"][p - 1].items():
-                    #     new_volumes[k] = v
-                    # for k, v in self.args["shares"][p - 1].items():
-                    #     new_shares[k] = v
+            if p % 100 == 0:
+                print(p)
 
-                    new_prices = self.args["prices"][p - 1].copy()
-                    new_volumes = self.args["volumes"][p - 1].copy()
-                    new_shares = self.args["shares"][p - 1].copy()
+            self.market_data.advance(p)
 
-                    self.args["funds"].append(self.args["funds"][p - 1])
+            if self.market_universe.uses_market_data():
+                self.args["universe"][p] = self.market_universe.restrict(registry, self.args["universe"][p], self.market_data.prices[p], self.market_data.volumes[p])
 
-                self.args["prices"].append(new_prices)
-                self.args["volumes"].append(new_volumes)
-                self.args["shares"].append(new_shares)
+            if p == 0:
+                self.args["funds"].append(self.args["initial_funds"])
+            else:
+                new_shares = self.args["shares"][p - 1].copy()
 
-                self.args["buy_count"].append(0)
-                self.args["sell_count"].append(0)
-                self.args["trade_signals"].append(list())
+                self.args["funds"].append(self.args["funds"][p - 1])
 
-                data = dict()
+            self.args["shares"].append(new_shares)
 
-                # print(self.args["shares"][p])
+            self.args["buy_count"].append(0)
+            self.args["sell_count"].append(0)
+            self.args["trade_signals"].append(SignalBatch())
 
-                # Start Execution of Strategy for Period
-                exec_strategy(self.args)
+            data = dict()
 
-                # Publish Update to Subscribers
+            # print(self.args["shares"][p])
 
-                # Unpack Trade Signals
-                trade_signals = []
+            # Start Execution of Strategy for Period
+            exec_strategy(self.args)
 
-                for ts in self.args["trade_signals"][p]:
-                    trade_signals.append((ts.signal_type, ts.symbol, ts.quantity))
-                data["trade_signals"] = trade_signals
+            # Publish Update to Subscribers
 
-                # Sending Price and Volume Data
-                data["prices"] = self.args["prices"][p]
-                data["volumes"] = self.args["volumes"][p]
+            # Sending Price and Volume Data as rows ordered by the symbol list
+            data["prices"] = self.market_data.prices[p].tolist()
+            data["volumes"] = self.market_data.volumes[p].tolist()
 
-                data["funds"] = self.args["funds"][p]
-                data["shares"] = self.args["shares"][p]
-                data["buy_count"] = self.args["buy_count"][p]
-                data["sell_count"] = self.args["sell_count"][p]
+            data["funds"] = self.args["funds"][p]
+            data["shares"] = self.args["shares"][p]
+            data["buy_count"] = self.args["buy_count"][p]
+            data["sell_count"] = self.args["sell_count"][p]
 
-                data["time"] = p
+            data["time"] = p
 
-                # tm.start()
-                self.channel.basic_publish(exchange="", routing_key=self.queue_prefix + STAGE_B_NAME, body=json.dumps(data), properties=pika.BasicProperties(delivery_mode=2, ))
-                # print(tm.end())
+            # tm.start()
+            self.channel.basic_publish(exchange="", routing_key=self.queue_prefix + STAGE_B_NAME, body=pack_frame(data, self.args["trade_signals"][p]), properties=pika.BasicProperties(delivery_mode=2, ))
+            # print(tm.end())
 
-                p += 1
+            p += 1
         print("Completed Stage B")
 
 
@@ -420,14 +478,16 @@ class StageC(Stage):
 
         self.connectionB = None
         self.channelB = None
+        self.market_data = None
 
     def setup(self):
         print("Starting Stage C")
 
         try:
             # Init Arguments Used
-            self.args["prices"] = list()
-            self.args["volumes"] = list()
+            self.market_data = MarketData(fetch_symbol_registry(), self.args["period"])
+            self.args["prices"] = self.market_data.prices
+            self.args["volumes"] = self.market_data.volumes
 
             self.args["trade_signals"] = list()
 
@@ -447,13 +507,15 @@ class StageC(Stage):
             # Naming Queue and setting Durable tag to ensure currently queued messages are guaranteed to not be lost even in the case of a RabbitMQ error or shutdown
             self.channel.queue_declare(queue=self.queue_prefix + STAGE_C_NAME, durable=True)
 
-            stage_b_coms = Thread(target=self.handle_stage_b_data, daemon=True)
+            stage_b_coms = Thread(target=self.consume, args=(self.handle_stage_b_data,), daemon=True)
 
             stage_b_coms.start()
 
             super().setup()
 
-            stage_b_coms.join()
+            # A pruned run receives no further periods, the daemon consumer ends with the process
+            if not self.args.get("pruned"):
+                stage_b_coms.join()
         except KeyboardInterrupt:
             self.connection.close()
             quit(0)
@@ -475,19 +537,12 @@ class StageC(Stage):
 
     def proc_stage_b_data(self, ch, method, properties, body):
         # Store data
-        data = json.loads(body)
-
-        # Repack TradeSignals
-        trade_signals = []
-
-        for st, s, q in data["trade_signals"]:
-            trade_signals.append(TradeSignal(signal_type=st, symbol=s, quantity=q))
+        data, trade_signals = unpack_frame(body)
 
         self.args["trade_signals"].append(trade_signals)
 
-        self.args["prices"].append(data["prices"])
-        self.args["volumes"].append(data["volumes"])
-        self.args["shares"].append(data["shares"])
+        self.market_data.set_row(data["time"], data["prices"], data["volumes"])
+        self.args["shares"].append(unpack_shares(data["shares"]))
         self.args["funds"].append(data["funds"])
         self.args["buy_count"].append(data["buy_count"])
         self.args["sell_count"].append(data["sell_count"])
@@ -499,7 +554,7 @@ class StageC(Stage):
         if data["time"] == self.args["period"] - 1:
             ch.stop_consuming()
 
-        self.args["stage_b_time"] = data["time"]
+        self.publish(stage_b_time=data["time"])
 
     def exec_stage(self):
         period = self.args["period"]
@@ -507,47 +562,47 @@ class StageC(Stage):
         p = 0
 
         while p < period:
-            self.args["time"] = p
+            # Wait for stage b to send the period
+            if not self.wait_for_input(lambda: self.args["stage_b_time"] >= p):
+                raise RuntimeError("Stage C Input Lost")
 
-            if self.args["stage_b_time"] == p:
-                data = dict()
+            self.args["time"] = p
 
-                # print(self.args["trade_signals"][p])
+            data = dict()
 
-                # Start Portfolio Rebalancing
-                rebal_portfolio(self.args)
+            # print(self.args["trade_signals"][p])
 
-                # Start Generating Orders
-                gen_order(self.args)
+            # Start Portfolio Rebalancing
+            rebal_portfolio(self.args)
 
-                # Start Statistics Calculation
-                calc_stats(self.args)
+            # Start Generating Orders
+            gen_order(self.args)
 
-                # Start Pushing Data
-                push_data(self.args)
+            # Start Statistics Calculation
+            calc_stats(self.args)
+            check_stop(self.args)
 
-                # Publish Update to Subscribers
+            # Start Pushing Data
+            push_data(self.args)
 
-                # Unpack Trade Signals
-                trade_signals = []
+            # Publish Update to Subscribers
 
-                for ts in self.args["trade_signals"][p]:
-                    trade_signals.append((ts.signal_type, ts.symbol, ts.quantity))
-                data["trade_signals"] = trade_signals
+            # Price and Volume Data is owned by stage b and is not sent back
 
-                # Sending Price and Volume Data
-                data["prices"] = self.args["prices"][p]
-                data["volumes"] = self.args["volumes"][p]
+            data["funds"] = self.args["funds"][p]
+            data["shares"] = self.args["shares"][p]
+            data["buy_count"] = self.args["buy_count"][p]
+            data["sell_count"] = self.args["sell_count"][p]
 
-                data["funds"] = self.args["funds"][p]
-                data["shares"] = self.args["shares"][p]
-                data["buy_count"] = self.args["buy_count"][p]
-                data["sell_count"] = self.args["sell_count"][p]
+            data["time"] = p
+            data["pruned"] = self.args.get("pruned")
 
-                data["time"] = p
+            self.channel.basic_publish(exchange="", routing_key=self.queue_prefix + STAGE_C_NAME, body=pack_frame(data, self.args["trade_signals"][p]), properties=pika.BasicProperties(delivery_mode=2, ))
 
-                self.channel.basic_publish(exchange="", routing_key=self.queue_prefix + STAGE_C_NAME, body=json.dumps(data), properties=pika.BasicProperties(delivery_mode=2, ))
+            p += 1
 
-                p += 1
+            if self.args.get("pruned"):
+                print("Pruned at Period:", p - 1, "|", self.args["pruned"])
+                break
 
         print("Completed Stage C")
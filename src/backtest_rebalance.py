@@ -0,0 +1,48 @@
+import numpy as np
+
+from src.backtest_signals import SignalBatch
+
+
+# Constraints project the net pending quantities of a set of symbols onto quantities satisfying the constraint
+# Every array is aligned with the projected symbols, buys are positive and sells negative
+class ConcentrationCap:
+    __slots__ = ['max_stock_percentage']
+
+    def __init__(self, max_stock_percentage):
+        self.max_stock_percentage = max_stock_percentage
+
+    def project(self, positions, quantities, prices, balance):
+        cap = self.max_stock_percentage
+        stock_percentage = (prices * positions) / balance
+
+        # Positions already over the cap drop their buys, keep their sells and sell down to the cap
+        over = stock_percentage > cap
+        kept = np.where(over, np.minimum(quantities, 0), quantities)
+        post_trade_stock_percentage = (prices * (positions + kept)) / balance
+        sell_target = np.trunc((post_trade_stock_percentage - cap) * balance / prices).astype(np.int64)
+        kept = np.where(over & (post_trade_stock_percentage > cap) & (sell_target > 0), kept - sell_target, kept)
+
+        # Buys pushing a position under the cap over it are reduced to the cap
+        under = (stock_percentage < cap) & (quantities > 0) & (post_trade_stock_percentage > cap)
+        reduce_target = sell_target
+        return np.where(under & (quantities >= reduce_target), quantities - reduce_target, kept)
+
+
+def constraints_of(args):
+    return args.get("constraints") or [ConcentrationCap(args["max_stock_percentage"])]
+
+
+# Applies every constraint in order to the net pending signals and returns the adjusted batch, one signal per symbol
+# positions are dense held shares by symbol id, prices the period's price row
+def rebalance(positions, trade_signals, prices, balance, constraints):
+    pending = np.zeros(len(positions), dtype=np.int64)
+    np.add.at(pending, trade_signals.symbols, trade_signals.signal_types.astype(np.int64) * trade_signals.quantities)
+
+    ids = np.flatnonzero(positions | pending)
+    quantities = pending[ids]
+
+    for c in constraints:
+        quantities = c.project(positions[ids], quantities, prices[ids], balance)
+
+    traded = quantities != 0
+    return SignalBatch.from_arrays(np.sign(quantities[traded]), ids[traded], np.abs(quantities[traded]))
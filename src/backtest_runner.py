@@ -1,35 +1,181 @@
 from src.backtest_synchronous import BackTest as BTS
 from src.backtest_multiprocessing import BackTest as BTM
 from src.backtest_rabbitmq import BackTest as BTR
+from src.backtest_strategies import load_strategy, resolve_strategy_class, STRATEGY_REGISTRY
+from src.backtest_sweep import run_sweep, save_sweep_table
+from src.backtest_monte_carlo import run_monte_carlo
+from src.backtest_checkpoint import latest_checkpoint, checkpoint_dir
+from src.backtest_scheduler import BacktestScheduler, estimate_memory
+from src.backtest_utils import result_path, fetch_symbol_registry, assure_init_data
+
+import json
+import os
 
-scheduled_backtests = dict()
 EM_SYNCHRONOUS = 0
 EM_MULTIPROCESSING = 1
 EM_RABBITMQ = 2
 
+ENGINES = {EM_SYNCHRONOUS: BTS, EM_MULTIPROCESSING: BTM, EM_RABBITMQ: BTR}
 
-def signal_backtest(user_id, strategy_id, execution_mode=0, kwargs={"period": 30}):
-    print("Scheduling Backtest")
+# (processes, copies of the market data) of every execution mode, used for the memory estimate of a backtest
+ENGINE_FOOTPRINT = {EM_SYNCHRONOUS: (1, 1), EM_MULTIPROCESSING: (4, 1), EM_RABBITMQ: (4, 2)}
+
+scheduler = None
+
+
+# Loads the symbol registry, the initial market data and the registered strategies once for every worker
+def warm_up():
+    fetch_symbol_registry()
+    assure_init_data()
+
+    for strategy_id in STRATEGY_REGISTRY.keys():
+        resolve_strategy_class(strategy_id)
+
+
+# First backtest id after every id found in the results and checkpoints, ids of earlier sessions are never reused
+def next_backtest_id():
+    ids = [-1]
+
+    for directory in (os.path.dirname(result_path(0, 0, 0)), os.path.dirname(checkpoint_dir(0, 0, 0))):
+        if os.path.isdir(directory):
+            ids.extend(int(name.rsplit("-", 1)[1]) for name in os.listdir(directory) if name.rsplit("-", 1)[-1].isdigit())
+
+    return max(ids) + 1
+
+
+# Backtests run on a fixed pool of warm workers started with the first submitted backtest
+# Job ids double as backtest ids and continue after the runs already on disk
+def fetch_scheduler(workers=None, memory_limit=None):
+    global scheduler
+
+    if scheduler is None:
+        scheduler = BacktestScheduler(ENGINES, workers, memory_limit, warm_up, next_backtest_id()).start()
+
+    return scheduler
 
-    global scheduled_backtests
-    backtest_id = len(scheduled_backtests.items())
-    period = kwargs["period"]
-    backtest = BTR(user_id=user_id, strategy_id=strategy_id, backtest_id=backtest_id, period=period) if execution_mode == EM_RABBITMQ else (BTM(user_id=user_id, strategy_id=strategy_id, backtest_id=backtest_id, period=period) if execution_mode == EM_MULTIPROCESSING else (BTS(user_id=user_id, strategy_id=strategy_id, backtest_id=backtest_id, period=period) if execution_mode == EM_SYNCHRONOUS else None))
 
-    if not backtest:
+def submit_backtest(user_id, execution_mode, engine_kwargs, priority=0):
+    memory = estimate_memory(engine_kwargs["period"], len(fetch_symbol_registry()), *ENGINE_FOOTPRINT[execution_mode])
+    return fetch_scheduler().submit(user_id, execution_mode, engine_kwargs, priority, memory)
+
+
+# Queues a backtest and returns its id, higher priorities are started first
+def signal_backtest(user_id, strategy_id, execution_mode=0, kwargs={"period": 30}, priority=0):
+    print("Scheduling Backtest")
+
+    if execution_mode not in ENGINES:
         print("Invalid Execution Mode Specified:", execution_mode)
         quit(0)
 
-    scheduled_backtests[user_id, strategy_id, backtest_id] = backtest
-    backtest.start()
+    try:
+        strategy = load_strategy(strategy_id, **kwargs.get("strategy_params", {}))
+    except (KeyError, ImportError, AttributeError) as e:
+        print("Invalid Strategy Specified:", strategy_id, e)
+        quit(0)
+
+    backtest_id = submit_backtest(user_id, execution_mode, {"strategy_id": strategy_id, "period": kwargs["period"], "data_source": kwargs.get("data_source"), "universe_filter": kwargs.get("universe_filter"),
+                                                            "strategy": strategy, "stopping_policies": kwargs.get("stopping_policies")}, priority)
+
+    print("Finished Scheduling Backtest")
+    return backtest_id
+
+
+# Continues a crashed or stopped backtest from its latest checkpoint, the results equal those of an uninterrupted run
+# Synchronous and multiprocessing checkpoints hold the same state, either engine resumes either one
+def resume_backtest(user_id, strategy_id, backtest_id, execution_mode=EM_SYNCHRONOUS, priority=0):
+    print("Resuming Backtest")
+
+    if execution_mode == EM_RABBITMQ:
+        print("Execution Mode Cannot Resume:", execution_mode)
+        quit(0)
+
+    checkpoint = latest_checkpoint(user_id, strategy_id, backtest_id)
+
+    if not checkpoint:
+        print("No Checkpoint Found:", user_id, strategy_id, backtest_id)
+        quit(0)
+
+    config = checkpoint["config"]
+    job_id = submit_backtest(user_id, execution_mode, {"strategy_id": strategy_id, "backtest_id": backtest_id, "period": config["period"], "data_source": config["data_source"],
+                                                       "universe_filter": config["universe_filter"], "strategy": config["strategy"], "stopping_policies": config["stopping_policies"],
+                                                       "checkpoint_interval": config["checkpoint_interval"], "checkpoint": checkpoint}, priority)
+
+    print("Finished Scheduling Backtest")
+    return job_id
+
+
+# Starts a new synchronous backtest sharing the first `time` periods of a parent run, only the periods from `time` on are simulated
+# kwargs may change the period, strategy_params, stopping_policies and the engine settings transaction_cost and max_stock_percentage
+def branch_backtest(user_id, strategy_id, parent_backtest_id, time, kwargs={}, priority=0):
+    print("Branching Backtest")
+
+    checkpoint = latest_checkpoint(user_id, strategy_id, parent_backtest_id, time - 1)
+
+    if not checkpoint:
+        print("No Checkpoint Before Period:", time, "|", user_id, strategy_id, parent_backtest_id)
+        quit(0)
+
+    config = checkpoint["config"]
+    period = kwargs.get("period", config["period"])
+
+    if not checkpoint["time"] < time < period:
+        print("Invalid Branch Period Specified:", time)
+        quit(0)
+
+    strategy = load_strategy(strategy_id, **kwargs["strategy_params"]) if "strategy_params" in kwargs else config["strategy"]
+    settings = {k: kwargs[k] for k in ("transaction_cost", "max_stock_percentage") if k in kwargs}
+
+    backtest_id = submit_backtest(user_id, EM_SYNCHRONOUS, {"strategy_id": strategy_id, "period": period, "data_source": config["data_source"], "universe_filter": config["universe_filter"],
+                                                            "strategy": strategy, "stopping_policies": kwargs.get("stopping_policies", config["stopping_policies"]),
+                                                            "checkpoint_interval": config["checkpoint_interval"], "checkpoint": checkpoint, "settings": settings,
+                                                            "branch": (parent_backtest_id, time)}, priority)
 
     print("Finished Scheduling Backtest")
+    return backtest_id
+
+
+def backtest_status(job_id):
+    return fetch_scheduler().status(job_id)
+
+
+def cancel_backtest(job_id):
+    return fetch_scheduler().cancel(job_id)
+
+
+# Evaluates every configuration over one shared market path, see param_grid for building configurations
+def signal_sweep(user_id, strategy_id, configs, kwargs={"period": 30}):
+    print("Running Sweep:", len(configs), "configurations")
+
+    rows = run_sweep(strategy_id, configs, period=kwargs["period"], universe_filter=kwargs.get("universe_filter"), data_source=kwargs.get("data_source"), workers=kwargs.get("workers"), stopping_policies=kwargs.get("stopping_policies"))
+    save_sweep_table(result_path(user_id, strategy_id, "sweep") + ".csv", rows)
+
+    print("Finished Sweep")
+    return rows
+
+
+# Simulates kwargs["paths"] price paths in one batched run and stores the distribution statistics
+def signal_monte_carlo(user_id, strategy_id, kwargs={"period": 30, "paths": 1000}):
+    print("Running Monte Carlo:", kwargs.get("paths", 1000), "paths")
+
+    result = run_monte_carlo(strategy_id, paths=kwargs.get("paths", 1000), period=kwargs["period"], seeds=kwargs.get("seeds"), universe_filter=kwargs.get("universe_filter"),
+                             strategy=load_strategy(strategy_id, **kwargs.get("strategy_params", {})))
+
+    summary = {k: (v.tolist() if hasattr(v, "tolist") else v) for k, v in result.items()}
+
+    with open(result_path(user_id, strategy_id, "monte_carlo") + ".json", "w") as f:
+        json.dump(summary, f)
+
+    print("Terminal Balance Quantiles:", result["terminal_balance_quantiles"])
+    print("Max Drawdown Quantiles:", result["max_drawdown_quantiles"])
+    print("Finished Monte Carlo")
+    return result
 
 
 def terminate():
-    global scheduled_backtests
+    global scheduler
 
     print("Cleaning Up")
 
-    for _, value in scheduled_backtests.items():
-        value.join()
+    if scheduler is not None:
+        scheduler.shutdown()
+        scheduler = None
@@ -0,0 +1,287 @@
+import gc
+import os
+import signal
+from itertools import count
+from threading import Thread, Condition, Timer
+from multiprocessing import Process, Pipe
+from multiprocessing.connection import wait
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+JOB_REJECTED = "rejected"
+
+JOB_FINISHED = (JOB_DONE, JOB_FAILED, JOB_CANCELLED, JOB_REJECTED)
+
+# Rough footprint of a backtest process and of every period it keeps, on top of its price and volume rows
+BACKTEST_BASE_MEMORY = 64 * 1024 * 1024
+BACKTEST_PERIOD_MEMORY = 2048
+
+# Seconds a cancelled job is given to unwind before its process group is killed
+CANCEL_TIMEOUT = 5
+
+
+# Estimated peak memory of a backtest, processes it runs and copies of the (period x symbol) price and volume rows it holds
+def estimate_memory(period, symbols, processes=1, copies=1):
+    return processes * BACKTEST_BASE_MEMORY + copies * period * symbols * 16 + period * BACKTEST_PERIOD_MEMORY
+
+
+def available_memory():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+class BacktestJob:
+    __slots__ = ['job_id', 'user_id', 'execution_mode', 'engine_kwargs', 'priority', 'memory', 'status', 'error']
+
+    def __init__(self, job_id, user_id, execution_mode, engine_kwargs, priority=0, memory=0):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.execution_mode = execution_mode
+        self.engine_kwargs = engine_kwargs
+        self.priority = priority
+        self.memory = memory
+        self.status = JOB_QUEUED
+        self.error = None
+
+
+# Engines end on KeyboardInterrupt, raised on SIGTERM their finally blocks release shared memory and close results
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+# Runs the jobs sent over conn one after the other, the engine runs in this process and may start its own stage processes
+def _worker_loop(conn, engines):
+    # Leads its own process group, cancelling a job also ends the stage processes its engine started
+    # Stage processes are forked from the worker and inherit the handler
+    os.setpgrp()
+    signal.signal(signal.SIGTERM, _interrupt)
+
+    while True:
+        job = conn.recv()
+
+        if job is None:
+            break
+
+        job_id, execution_mode, engine_kwargs = job
+
+        try:
+            engines[execution_mode](**engine_kwargs).run_backtest()
+            conn.send((job_id, JOB_DONE, None))
+        except Exception as e:
+            conn.send((job_id, JOB_FAILED, repr(e)))
+
+
+class _Worker:
+    __slots__ = ['process', 'conn', 'job']
+
+    def __init__(self, engines):
+        self.conn, child_conn = Pipe()
+        self.process = Process(target=_worker_loop, args=(child_conn, engines))
+        self.process.start()
+        self.job = None
+
+        child_conn.close()
+
+
+# Runs submitted backtests on a fixed number of worker processes
+# The next job is the one with the highest priority, then of the user with the fewest running jobs, then the oldest
+# A job is only started while the memory estimates of the running jobs and its own fit in memory_limit
+# warm_up runs once before the workers are forked, whatever it loads is shared with every worker copy-on-write
+# Job ids count up from first_job_id
+class BacktestScheduler:
+
+    def __init__(self, engines, workers=None, memory_limit=None, warm_up=None, first_job_id=0):
+        self.engines = engines
+        self.warm_up = warm_up
+        self.worker_count = max(1, workers or os.cpu_count() or 1)
+        self.memory_limit = memory_limit if memory_limit is not None else available_memory()
+
+        self.jobs = dict()
+        self.queue = list()
+        self.running = dict()       # user id -> running job count
+        self.used_memory = 0
+        self.workers = list()
+        self.closing = False
+
+        self._ids = count(first_job_id)
+        self._lock = Condition()
+        self._wake_r, self._wake_w = Pipe(duplex=False)
+        self._dispatcher = None
+
+    def start(self):
+        if self._dispatcher:
+            return self
+
+        if self.warm_up:
+            self.warm_up()
+
+        # Objects loaded so far are left out of garbage collection, collections in the workers would otherwise write to and copy their pages
+        gc.freeze()
+
+        self.workers = [_Worker(self.engines) for _ in range(self.worker_count)]
+        self._dispatcher = Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+        return self
+
+    # Returns the job id, engine_kwargs are passed to the engine of execution_mode and get the job id as backtest_id unless they set one
+    def submit(self, user_id, execution_mode, engine_kwargs, priority=0, memory=0):
+        with self._lock:
+            job_id = next(self._ids)
+            engine_kwargs = dict(engine_kwargs, user_id=user_id)
+            engine_kwargs.setdefault("backtest_id", job_id)
+
+            job = BacktestJob(job_id, user_id, execution_mode, engine_kwargs, priority, memory)
+            self.jobs[job_id] = job
+
+            if self.memory_limit and memory > self.memory_limit:
+                job.status = JOB_REJECTED
+                job.error = "Estimated memory {} exceeds the limit {}".format(memory, self.memory_limit)
+                self._lock.notify_all()
+            else:
+                self.queue.append(job)
+                self._wake()
+
+        return job_id
+
+    def status(self, job_id):
+        return self.jobs[job_id].status
+
+    # Queued jobs are dropped, running jobs are terminated along with their stage processes, returns False for finished jobs
+    # A running job is killed once it did not end within CANCEL_TIMEOUT
+    def cancel(self, job_id):
+        with self._lock:
+            job = self.jobs[job_id]
+
+            if job.status == JOB_QUEUED:
+                self.queue.remove(job)
+                job.status = JOB_CANCELLED
+                self._lock.notify_all()
+                return True
+
+            if job.status != JOB_RUNNING:
+                return False
+
+            job.status = JOB_CANCELLED
+
+            for worker in self.workers:
+                if worker.job is job:
+                    self._signal(worker.process.pid, signal.SIGTERM)
+
+                    timer = Timer(CANCEL_TIMEOUT, self._kill, (worker, job))
+                    timer.daemon = True
+                    timer.start()
+
+            return True
+
+    # The worker is replaced once its job ended, its process group may still hold stage processes of the job
+    def _kill(self, worker, job):
+        with self._lock:
+            pid = worker.process.pid if worker.job is job else None
+
+        if pid is not None:
+            self._signal(pid, signal.SIGKILL)
+
+    def _signal(self, pid, signum):
+        try:
+            os.killpg(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    # Blocks until the given jobs, or every submitted job, finished
+    def join(self, job_ids=None):
+        with self._lock:
+            self._lock.wait_for(lambda: all(self.jobs[j].status in JOB_FINISHED for j in (job_ids if job_ids is not None else list(self.jobs.keys()))))
+
+    def shutdown(self):
+        self.join()
+
+        with self._lock:
+            self.closing = True
+            self._wake()
+
+        if self._dispatcher:
+            self._dispatcher.join()
+
+        for worker in self.workers:
+            if worker.process.is_alive():
+                worker.conn.send(None)
+
+            worker.process.join()
+
+    def _wake(self):
+        self._wake_w.send(None)
+
+    def _dispatch(self):
+        while True:
+            with self._lock:
+                if self.closing:
+                    return
+
+                self._admit()
+                conns = [w.conn for w in self.workers]
+
+            for conn in wait(conns + [self._wake_r]):
+                if conn is self._wake_r:
+                    while conn.poll():
+                        conn.recv()
+                    continue
+
+                with self._lock:
+                    self._receive(next(w for w in self.workers if w.conn is conn))
+
+    # Starts queued jobs on idle workers, only while the first job in line fits in memory so large jobs are not starved
+    def _admit(self):
+        while self.queue:
+            worker = next((w for w in self.workers if w.job is None), None)
+
+            if worker is None:
+                return
+
+            # A linear scan, the queue is only scanned when a worker is idle
+            job = min(self.queue, key=lambda j: (-j.priority, self.running.get(j.user_id, 0), j.job_id))
+
+            if self.memory_limit and self.used_memory and self.used_memory + job.memory > self.memory_limit:
+                return
+
+            if not worker.process.is_alive():
+                self._respawn(worker)
+
+            self.queue.remove(job)
+            job.status = JOB_RUNNING
+            worker.job = job
+            self.running[job.user_id] = self.running.get(job.user_id, 0) + 1
+            self.used_memory += job.memory
+
+            worker.conn.send((job.job_id, job.execution_mode, job.engine_kwargs))
+
+    def _receive(self, worker):
+        job = worker.job
+
+        try:
+            _, status, error = worker.conn.recv()
+        except EOFError:
+            # The worker exited, either killed by a cancel or crashed while running its job
+            status, error = JOB_FAILED, "Worker exited"
+            self._respawn(worker)
+
+        if job is None:
+            return
+
+        if job.status != JOB_CANCELLED:
+            job.status = status
+            job.error = error
+
+        worker.job = None
+        self.running[job.user_id] -= 1
+        self.used_memory -= job.memory
+        self._lock.notify_all()
+
+    def _respawn(self, worker):
+        worker.process.join()
+        worker.conn.close()
+        worker.__init__(self.engines)
@@ -0,0 +1,113 @@
+from multiprocessing import shared_memory, Semaphore
+
+import numpy as np
+
+from src.backtest_signals import SignalBatch
+
+# Header slots, every slot has one writing stage and is only read by the others
+HEADER_STAGE_A_TIME = 0     # Stage a, periods with a universe
+HEADER_STAGE_B_TIME = 1     # Stage b, periods with signals
+HEADER_STAGE_C_TIME = 2     # Stage c, periods filled and pushed
+HEADER_BUY_COUNT = 3        # Stage b, buys of the period in the signal slot
+HEADER_SELL_COUNT = 4       # Stage b, sells of the period in the signal slot
+HEADER_SIGNAL_COUNT = 5     # Stage b, signals in the signal slot
+HEADER_PRUNED = 6           # Stage c, set when a stopping policy ended the run
+HEADER_FAILED = 7           # Any stage, set when a stage raised so the others stop waiting on it
+HEADER_FIELDS = 8
+
+
+# Without a buffer only the size of the layout is computed
+def _carve(buffer, offset, dtype, shape):
+    nbytes = np.dtype(dtype).itemsize * int(np.prod(shape))
+    array = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset) if buffer is not None else None
+
+    # Every region starts 8 byte aligned
+    return array, offset + (nbytes + 7) // 8 * 8
+
+
+def _layout(buffer, period, symbols):
+    regions = dict()
+    offset = 0
+
+    for name, dtype, shape in (("header", np.int64, (HEADER_FIELDS,)), ("funds", np.float64, (1,)), ("positions", np.int64, (symbols,)),
+                               ("signal_types", np.int8, (symbols,)), ("signal_symbols", np.int32, (symbols,)), ("signal_quantities", np.int64, (symbols,)),
+                               ("universe_source", np.int64, (period,)), ("universe_rows", np.bool_, (period, symbols))):
+        regions[name], offset = _carve(buffer, offset, dtype, shape)
+
+    return regions, offset
+
+
+# Run state of the multiprocessing engine in one shared memory block, read by every stage without a round trip to a manager
+# Stage a owns the universe rows, stage b the signal slot and counts, stage c the funds and positions
+# Stage b only executes a period after stage c finished the previous one, one signal slot is enough
+# Each hand-off is released once per period by its producing stage, the consuming stage blocks on it instead of polling the header
+class SharedRunState:
+    __slots__ = ['memory', 'header', 'funds', 'positions', 'signal_types', 'signal_symbols', 'signal_quantities', 'universe_source', 'universe_rows',
+                 'universe_ready', 'signals_ready', 'period_done']
+
+    def __init__(self, period, symbols, initial_funds):
+        _, size = _layout(None, period, symbols)
+        self.memory = shared_memory.SharedMemory(create=True, size=size)
+
+        regions, _ = _layout(self.memory.buf, period, symbols)
+
+        for name, array in regions.items():
+            array[...] = 0
+            setattr(self, name, array)
+
+        self.funds[0] = initial_funds
+
+        self.universe_ready = Semaphore(0)      # Stage a -> stage b
+        self.signals_ready = Semaphore(0)       # Stage b -> stage c
+        self.period_done = Semaphore(0)         # Stage c -> stage b
+
+    def stopped(self):
+        return bool(self.header[HEADER_PRUNED] or self.header[HEADER_FAILED])
+
+    # Releases every blocked stage, woken stages check stopped before handling another period
+    def wake(self):
+        self.universe_ready.release()
+        self.signals_ready.release()
+        self.period_done.release()
+
+    def fail(self):
+        self.header[HEADER_FAILED] = 1
+        self.wake()
+
+    # Universe of a period, rows are only written for periods where it changed
+    def universe_row(self, time):
+        return self.universe_rows[self.universe_source[time]]
+
+    def set_universe(self, time, mask=None):
+        if mask is None:
+            self.universe_source[time] = self.universe_source[time - 1]
+        else:
+            self.universe_rows[time] = mask
+            self.universe_source[time] = time
+
+    def holdings(self):
+        held = np.flatnonzero(self.positions)
+        return dict(zip(held.tolist(), self.positions[held].tolist()))
+
+    def put_signals(self, trade_signals):
+        count = len(trade_signals)
+
+        self.signal_types[:count] = trade_signals.signal_types
+        self.signal_symbols[:count] = trade_signals.symbols
+        self.signal_quantities[:count] = trade_signals.quantities
+        self.header[HEADER_SIGNAL_COUNT] = count
+        self.header[HEADER_BUY_COUNT] = np.count_nonzero(trade_signals.signal_types > 0)
+        self.header[HEADER_SELL_COUNT] = np.count_nonzero(trade_signals.signal_types < 0)
+
+    # Copied out of the slot, stage b overwrites it with the next period once stage c finished this one
+    def take_signals(self):
+        count = self.header[HEADER_SIGNAL_COUNT]
+        return SignalBatch.from_arrays(self.signal_types[:count].copy(), self.signal_symbols[:count].copy(), self.signal_quantities[:count].copy())
+
+    # Views into the block must be dropped before it can be closed
+    def close(self):
+        for name in self.__slots__[1:]:
+            setattr(self, name, None)
+
+        self.memory.close()
+        self.memory.unlink()
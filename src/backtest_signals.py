@@ -0,0 +1,106 @@
+import struct
+
+import numpy as np
+
+# count, padded to 8 bytes so the quantity column of an encoded batch stays aligned
+SIGNAL_BATCH_HEADER = struct.Struct("<I4x")
+
+
+# Trade signals stored as typed columns instead of one object per order
+# Columns are read only views of the first len(batch) entries, signals are edited through append, set_quantity and remove
+class SignalBatch:
+    __slots__ = ['_signal_types', '_symbols', '_quantities', 'size']
+
+    def __init__(self, capacity=16):
+        self._signal_types = np.empty(capacity, dtype=np.int8)
+        self._symbols = np.empty(capacity, dtype=np.int32)
+        self._quantities = np.empty(capacity, dtype=np.int64)
+        self.size = 0
+
+    @classmethod
+    def from_arrays(cls, signal_types, symbols, quantities):
+        batch = cls.__new__(cls)
+        batch._signal_types = np.ascontiguousarray(signal_types, dtype=np.int8)
+        batch._symbols = np.ascontiguousarray(symbols, dtype=np.int32)
+        batch._quantities = np.ascontiguousarray(quantities, dtype=np.int64)
+        batch.size = len(batch._signal_types)
+        return batch
+
+    # Decoded columns are read only views into buffer, they are copied on the first edit
+    @classmethod
+    def from_bytes(cls, buffer, offset=0):
+        (size,) = SIGNAL_BATCH_HEADER.unpack_from(buffer, offset)
+        offset += SIGNAL_BATCH_HEADER.size
+
+        batch = cls.__new__(cls)
+        batch._quantities = np.frombuffer(buffer, dtype=np.int64, count=size, offset=offset)
+        offset += 8 * size
+        batch._symbols = np.frombuffer(buffer, dtype=np.int32, count=size, offset=offset)
+        offset += 4 * size
+        batch._signal_types = np.frombuffer(buffer, dtype=np.int8, count=size, offset=offset)
+        batch.size = size
+        return batch
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return zip(self.signal_types.tolist(), self.symbols.tolist(), self.quantities.tolist())
+
+    def __repr__(self):
+        return "<SignalBatch {size} signals>".format(size=self.size)
+
+    @property
+    def signal_types(self):
+        return self._signal_types[:self.size]
+
+    @property
+    def symbols(self):
+        return self._symbols[:self.size]
+
+    @property
+    def quantities(self):
+        return self._quantities[:self.size]
+
+    def _own(self, capacity=0):
+        if self._quantities.flags.writeable and capacity <= len(self._quantities):
+            return
+
+        capacity = max(capacity, len(self._quantities), 16)
+
+        for name in ('_signal_types', '_symbols', '_quantities'):
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+
+    def append(self, signal_type, symbol, quantity):
+        if self.size == len(self._quantities) or not self._quantities.flags.writeable:
+            self._own(max(2 * self.size, 16))
+
+        self._signal_types[self.size] = signal_type
+        self._symbols[self.size] = symbol
+        self._quantities[self.size] = quantity
+        self.size += 1
+
+    def set_quantity(self, index, quantity):
+        if index >= self.size:
+            raise IndexError("Signal index out of range: " + str(index))
+
+        self._own()
+        self._quantities[index] = quantity
+
+    # Drops every signal where mask is set, keeping the order of the rest
+    def remove(self, mask):
+        keep = np.flatnonzero(~np.asarray(mask, dtype=bool))
+        self._signal_types = self._signal_types[keep]
+        self._symbols = self._symbols[keep]
+        self._quantities = self._quantities[keep]
+        self.size = len(keep)
+
+    # Header and column memoryviews, nothing is copied until the buffers are joined or written
+    def buffers(self):
+        return [SIGNAL_BATCH_HEADER.pack(self.size), memoryview(self._quantities[:self.size]), memoryview(self._symbols[:self.size]), memoryview(self._signal_types[:self.size])]
+
+    def to_bytes(self):
+        return b"".join(self.buffers())
@@ -0,0 +1,72 @@
+import math
+
+STOP_MAX_DRAWDOWN = "max_drawdown"
+STOP_MIN_BALANCE = "min_balance"
+STOP_SUCCESSIVE_HALVING = "successive_halving"
+
+
+# Stopping policies inspect each period's calc_stats record and return a reason when the run should end, None otherwise
+# state is a dict kept per run, policies may keep running values in it
+class MaxDrawdownStop:
+    __slots__ = ['max_drawdown']
+
+    def __init__(self, max_drawdown):
+        self.max_drawdown = max_drawdown
+
+    def check(self, record, state):
+        peak = max(state.get("peak_balance", record["balance"]), record["balance"])
+        state["peak_balance"] = peak
+
+        if peak > 0 and 1 - record["balance"] / peak > self.max_drawdown:
+            return STOP_MAX_DRAWDOWN
+
+
+class MinBalanceStop:
+    __slots__ = ['min_balance']
+
+    def __init__(self, min_balance):
+        self.min_balance = min_balance
+
+    def check(self, record, state):
+        if record["balance"] < self.min_balance:
+            return STOP_MIN_BALANCE
+
+
+# Asynchronous successive halving, at every rung a run continues only while its balance is within the top 1/eta of the
+# balances its sibling runs reported at the same rung
+# board is shared by the siblings, e.g. a manager dict for runs in other processes, every run only writes its own keys
+class SuccessiveHalvingStop:
+    __slots__ = ['rungs', 'eta', 'min_siblings', 'board']
+
+    def __init__(self, rungs, eta=2, min_siblings=None, board=None):
+        self.rungs = frozenset(rungs)
+        self.eta = eta
+        self.min_siblings = min_siblings or eta
+        self.board = board if board is not None else dict()
+
+    def check(self, record, state):
+        rung = record["time"] + 1
+
+        if rung not in self.rungs:
+            return None
+
+        self.board[rung, state["run_key"]] = record["balance"]
+        balances = sorted((v for (r, _), v in self.board.items() if r == rung), reverse=True)
+
+        if len(balances) < self.min_siblings:
+            return None
+
+        if record["balance"] < balances[max(0, math.ceil(len(balances) / self.eta) - 1)]:
+            return STOP_SUCCESSIVE_HALVING
+
+
+# Evaluates every policy in order against the latest record, the first reason given marks the record as pruned
+def evaluate_stopping(policies, record, state):
+    for policy in policies:
+        reason = policy.check(record, state)
+
+        if reason:
+            record["pruned"] = reason
+            return reason
+
+    return None
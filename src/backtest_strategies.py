@@ -0,0 +1,70 @@
+from importlib import import_module
+
+import numpy as np
+
+from src.backtest_signals import SignalBatch
+from src.backtest_utils import strategy_kernel, strategy_kernel_paths
+
+# Inputs an engine can hand to a strategy, only the declared ones are computed
+# symbols, old_prices, prices, funds, transaction_cost and time are always provided
+STRATEGY_INPUTS = ("symbols", "old_prices", "prices", "volumes", "positions", "funds", "transaction_cost", "time")
+
+# strategy_id -> "module:attribute", modules are only imported when a strategy is loaded
+STRATEGY_REGISTRY = {
+    0: "src.backtest_strategies:MomentumStrategy",
+}
+
+_loaded_strategies = dict()
+
+
+# Batched strategy contract, on_period receives the declared inputs as arrays aligned with the universe symbol ids
+# on_paths is optional and receives (path x symbol) arrays, one funds value per path and the generator to draw from
+# It returns aligned (signal_types, quantities) arrays, used by Monte Carlo runs
+class Strategy:
+    inputs = ()
+
+    def on_period(self, arrays):
+        raise NotImplementedError
+
+    def on_paths(self, arrays):
+        raise NotImplementedError(type(self).__name__ + " does not support batched paths")
+
+
+# Sells a random part of a position when its price falls and buys a random part of the volume when it rises
+class MomentumStrategy(Strategy):
+    inputs = ("volumes", "positions")
+
+    def __init__(self, max_sell_out_percentage=0.10, max_buy_out_percentage=0.10):
+        self.max_sell_out_percentage = max_sell_out_percentage
+        self.max_buy_out_percentage = max_buy_out_percentage
+
+    def on_period(self, arrays):
+        signal_types, quantities = strategy_kernel(arrays["old_prices"], arrays["prices"], arrays["volumes"], arrays["positions"], arrays["funds"], arrays["transaction_cost"],
+                                                   self.max_sell_out_percentage, self.max_buy_out_percentage)
+
+        signaled = np.flatnonzero(signal_types)
+        return SignalBatch.from_arrays(signal_types[signaled], arrays["symbols"][signaled], quantities[signaled])
+
+    def on_paths(self, arrays):
+        return strategy_kernel_paths(arrays["old_prices"], arrays["prices"], arrays["volumes"], arrays["positions"], arrays["funds"], arrays["transaction_cost"],
+                                     self.max_sell_out_percentage, self.max_buy_out_percentage, arrays["generator"])
+
+
+def register_strategy(strategy_id, path):
+    STRATEGY_REGISTRY[strategy_id] = path
+    _loaded_strategies.pop(strategy_id, None)
+
+
+def resolve_strategy_class(strategy_id):
+    if strategy_id not in _loaded_strategies:
+        if strategy_id not in STRATEGY_REGISTRY:
+            raise KeyError("Unknown strategy id: " + str(strategy_id))
+
+        module, _, attribute = STRATEGY_REGISTRY[strategy_id].partition(":")
+        _loaded_strategies[strategy_id] = getattr(import_module(module), attribute)
+
+    return _loaded_strategies[strategy_id]
+
+
+def load_strategy(strategy_id, **params):
+    return resolve_strategy_class(strategy_id)(**params)
@@ -0,0 +1,206 @@
+import csv
+import os
+from itertools import product
+from multiprocessing import get_context, Manager
+
+import numpy as np
+
+import src.backtest_utils as backtest_utils
+from src.backtest_modules import exec_strategy, rebal_portfolio, gen_order, calc_stats, check_stop
+from src.backtest_market_data import MarketData
+from src.backtest_history import HistoricalFeed
+from src.backtest_signals import SignalBatch
+from src.backtest_strategies import load_strategy
+from src.backtest_universe import UniverseMask, DEFAULT_UNIVERSE
+
+# Configuration keys consumed by the engine, every other key is passed to the strategy as a parameter
+SWEEP_ENGINE_KEYS = ("transaction_cost", "max_stock_percentage", "initial_funds")
+SWEEP_DEFAULTS = {"transaction_cost": 6, "max_stock_percentage": 0.20, "initial_funds": 10000}
+
+SWEEP_COLUMNS = ("final_balance", "net", "final_funds", "buy_count", "sell_count", "min_balance", "max_drawdown", "periods", "pruned")
+
+# Market path shared by every configuration, set before the workers are forked so they read it copy-on-write
+_sweep_path = None
+
+
+# Cartesian product of the given value lists, e.g. param_grid(transaction_cost=[2, 6], max_buy_out_percentage=[0.05, 0.1])
+def param_grid(**axes):
+    keys = list(axes.keys())
+    return [dict(zip(keys, values)) for values in product(*axes.values())]
+
+
+def _sweep_args(strategy_id, config, period, prices, volumes, universes, first_prices):
+    settings = dict(SWEEP_DEFAULTS)
+    settings.update({k: v for k, v in config.items() if k in SWEEP_ENGINE_KEYS})
+
+    args = dict()
+    args["period"] = period
+    args["universe"] = universes
+    args["prices"] = prices
+    args["volumes"] = volumes
+    args["first_prices"] = first_prices
+    args["shares"] = list()
+    args["funds"] = list()
+    args["trade_signals"] = list()
+    args["statistics"] = list()
+    args["buy_count"] = list()
+    args["sell_count"] = list()
+    args["initial_funds"] = settings["initial_funds"]
+    args["transaction_cost"] = settings["transaction_cost"]
+    args["max_stock_percentage"] = settings["max_stock_percentage"]
+    args["replay"] = True
+    args["strategy"] = load_strategy(strategy_id, **{k: v for k, v in config.items() if k not in SWEEP_ENGINE_KEYS})
+    return args
+
+
+# Runs period p on prices already in args["prices"], the strategy draws from the random stream in its current state
+def _run_period(args, p):
+    args["time"] = p
+    args["shares"].append(dict(args["shares"][p - 1]) if p else dict())
+    args["funds"].append(args["funds"][p - 1] if p else args["initial_funds"])
+    args["buy_count"].append(0)
+    args["sell_count"].append(0)
+    args["trade_signals"].append(SignalBatch())
+
+    exec_strategy(args)
+    rebal_portfolio(args)
+    gen_order(args)
+    calc_stats(args)
+
+
+# Result row of a configuration from the periods it ran
+def _sweep_row(config, args):
+    balances = np.fromiter((s["balance"] for s in args["statistics"]), dtype=np.float64, count=len(args["statistics"]))
+    drawdowns = 1 - balances / np.maximum.accumulate(balances)
+
+    row = dict(config)
+    row["final_balance"] = float(balances[-1])
+    row["net"] = float(balances[-1] - args["initial_funds"])
+    row["final_funds"] = args["funds"][-1]
+    row["buy_count"] = sum(args["buy_count"])
+    row["sell_count"] = sum(args["sell_count"])
+    row["min_balance"] = float(balances.min())
+    row["max_drawdown"] = float(drawdowns.max())
+    row["periods"] = len(balances)
+    row["pruned"] = args.get("pruned") or ""
+    return row
+
+
+# Generates the (period x symbol) price and volume path and every period's universe once, the same way the engines do
+# The first configuration runs along with the generation so the random stream advances as in a synchronous run of it,
+# the stream state after each period's price changes is kept for the strategy draws of every other configuration
+# Every period is replayed against the previous row, period 0 against the initial prices like the engines do
+# Returns the path and the first configuration's result row
+def gen_sweep_path(strategy_id, config, period, universe_filter=None, data_source=None, stopping_policies=None):
+    prices, volumes = backtest_utils.assure_init_data()
+    registry = backtest_utils.fetch_symbol_registry()
+    feed = HistoricalFeed(data_source, registry, prices, volumes) if data_source else None
+    market_data = MarketData(registry, period, prices, volumes, feed=feed)
+    universe_mask = UniverseMask(universe_filter or DEFAULT_UNIVERSE)
+    universes = []
+    rng_states = []
+    first_prices = np.array(prices, dtype=np.float64)
+
+    args = _sweep_args(strategy_id, config, period, market_data.prices, market_data.volumes, universes, first_prices)
+    args["stopping_policies"] = stopping_policies
+    args["run_key"] = 0
+
+    for p in range(period):
+        market_data.advance(p)
+
+        if universe_mask.uses_market_data():
+            universe_mask.update(registry, market_data.prices[p], market_data.volumes[p])
+        else:
+            universe_mask.update(registry)
+
+        universes.append(universe_mask.ids)
+
+        if not feed:
+            backtest_utils.fetch_price_changes(p, market_data.prices, market_data.volumes, universe_mask.ids)
+
+        rng_states.append(backtest_utils.rng.bit_generator.state)
+
+        # A pruned first configuration stops trading, the path is still generated for the others
+        if not args.get("pruned"):
+            _run_period(args, p)
+            check_stop(args)
+
+    return (market_data.prices, market_data.volumes, universes, rng_states, first_prices), _sweep_row(config, args)
+
+
+def _run_config(task):
+    strategy_id, config, index, stopping_policies = task
+    prices, volumes, universes, rng_states, first_prices = _sweep_path
+    period = len(universes)
+
+    args = _sweep_args(strategy_id, config, period, prices, volumes, universes, first_prices)
+    args["stopping_policies"] = stopping_policies
+    args["run_key"] = index
+
+    for p in range(period):
+        # Every configuration draws the same random numbers, differences in the results come from the parameters alone
+        backtest_utils.rng.bit_generator.state = rng_states[p]
+        _run_period(args, p)
+
+        if check_stop(args):
+            break
+
+    return _sweep_row(config, args)
+
+
+# Generates the shared path, running the first configuration on the way, and returns its row with the tasks of the others
+def _start_sweep(strategy_id, configs, period, universe_filter, data_source, seed, stopping_policies):
+    global _sweep_path
+
+    backtest_utils.reset_rng(seed)
+    _sweep_path, first_row = gen_sweep_path(strategy_id, configs[0], period, universe_filter, data_source, stopping_policies)
+    return first_row, [(strategy_id, config, i, stopping_policies) for i, config in enumerate(configs) if i]
+
+
+# Runs every configuration over one shared market path and returns one result row per configuration, in order
+# The first row matches a synchronous run of the first configuration with the same seed
+# Configurations are fanned out to forked workers, workers=1 runs them in this process
+# Runs ended by a stopping policy report the statistics of the periods they ran and the reason in the pruned column
+def run_sweep(strategy_id, configs, period=365, universe_filter=None, data_source=None, workers=None, seed=None, stopping_policies=None):
+    global _sweep_path
+
+    seed = int(backtest_utils.seed) if seed is None else seed
+    workers = min(workers or os.cpu_count() or 1, len(configs) - 1)
+
+    # Every sweep compares its siblings on a fresh board, the caller's boards are put back once it finished
+    boarded = [(policy, policy.board) for policy in stopping_policies or () if hasattr(policy, "board")]
+
+    try:
+        if workers <= 1:
+            for policy, _ in boarded:
+                policy.board = dict()
+
+            first_row, tasks = _start_sweep(strategy_id, configs, period, universe_filter, data_source, seed, stopping_policies)
+            return [first_row] + [_run_config(t) for t in tasks]
+
+        with Manager() as manager:
+            # Sibling comparisons need one board shared by every worker
+            for policy, _ in boarded:
+                policy.board = manager.dict()
+
+            # The path is generated before the workers are forked
+            first_row, tasks = _start_sweep(strategy_id, configs, period, universe_filter, data_source, seed, stopping_policies)
+
+            with get_context("fork").Pool(workers) as pool:
+                return [first_row] + pool.map(_run_config, tasks)
+    finally:
+        _sweep_path = None
+
+        for policy, board in boarded:
+            policy.board = board
+
+
+def save_sweep_table(path, rows):
+    columns = list(dict.fromkeys(k for r in rows for k in r.keys() if k not in SWEEP_COLUMNS)) + list(SWEEP_COLUMNS)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
@@ -1,15 +1,27 @@
 from src.backtest_modules import *
+from src.backtest_market_data import MarketData
+from src.backtest_history import HistoricalFeed
+from src.backtest_checkpoint import CHECKPOINT_INTERVAL, push_checkpoint, restore_checkpoint, rewind_results, start_checkpoints, run_identity
+from src.backtest_branch import BRANCH_SETTING_KEYS, start_branch
 from src.timer import Timer
 
 
 class BackTest(Process):
 
-    def __init__(self, user_id, strategy_id, backtest_id, period=365):
+    def __init__(self, user_id, strategy_id, backtest_id, period=365, data_source=None, universe_filter=None, strategy=None, stopping_policies=None, checkpoint_interval=CHECKPOINT_INTERVAL, checkpoint=None,
+                 settings=None, branch=None):
         self.user_id = user_id
         self.strategy_id = strategy_id
         self.backtest_id = backtest_id
         self.period = period
-        self._manager = Manager()
+        self.data_source = data_source            # Historical bar file replayed instead of generated prices
+        self.universe_filter = universe_filter    # Universe definition, see compile_universe
+        self.strategy = strategy                  # Strategy object, loaded from the strategy registry by strategy_id when not given
+        self.stopping_policies = stopping_policies    # Policies ending the run early, see backtest_stopping
+        self.checkpoint_interval = checkpoint_interval    # Periods between checkpoints, 0 disables them
+        self.checkpoint = checkpoint              # Checkpoint state the run resumes from, see backtest_checkpoint
+        self.settings = settings                  # Overrides of the engine settings, e.g. transaction_cost or max_stock_percentage
+        self.branch = branch                      # (parent backtest id, period) the run branches from, the checkpoint is the parent's
 
         super().__init__(target=self.run_backtest, args=())
 
@@ -29,6 +41,10 @@ class BackTest(Process):
 
         print("Executing Backtest")
 
+        # Writing the branch's results and checkpoints would overwrite the parent it reads from
+        if self.branch and self.branch[0] == self.backtest_id:
+            raise ValueError("Branch shares its parent's backtest id: " + str(self.backtest_id))
+
         initial_funds = 10000
 
         # Fetches and caches historical price and volume data
@@ -36,8 +52,10 @@ class BackTest(Process):
 
         args = dict()
 
-        prices = []
-        volumes = []
+        # Prices and volumes are stored as contiguous (period x symbol) arrays
+        registry = fetch_symbol_registry()
+        feed = HistoricalFeed(self.data_source, registry, data[0], data[1]) if self.data_source else None
+        market_data = MarketData(registry, self.period, data[0], data[1], feed=feed)
 
         args["user_id"] = self.user_id
         args["strategy_id"] = self.strategy_id
@@ -46,8 +64,8 @@ class BackTest(Process):
         args["time"] = 0
         args["universe"] = list()
         args["shares"] = list()
-        args["prices"] = prices
-        args["volumes"] = volumes
+        args["prices"] = market_data.prices
+        args["volumes"] = market_data.volumes
         args["trade_signals"] = list()
         args["statistics"] = list()
         args["buy_count"] = list()
@@ -56,7 +74,34 @@ class BackTest(Process):
         args["funds"] = list()
         args["trade_signals"] = list()
         args["transaction_cost"] = 6
+        args["replay"] = feed is not None
+        args["first_prices"] = np.asarray(data[0], dtype=np.float64)    # Replayed period 0 is compared against the initial snapshot
+        args["universe_filter"] = self.universe_filter
+        args["data_source"] = self.data_source
+        args["strategy"] = self.strategy or load_strategy(self.strategy_id)
+        args["stopping_policies"] = self.stopping_policies
         args["max_stock_percentage"] = 0.20
+        args["flush_interval"] = 100
+        args["fsync_policy"] = FSYNC_ON_FLUSH
+        args["checkpoint_interval"] = self.checkpoint_interval
+        args.update(self.settings or {})
+
+        # A branch replays the parent from its checkpoint up to the branch period without writing results, then switches to its own settings
+        branch_time = self.branch[1] if self.branch else 0
+        branch_settings = {k: args[k] for k in BRANCH_SETTING_KEYS}
+
+        if self.checkpoint:
+            restore_checkpoint(args, market_data, self.checkpoint)
+
+            if self.branch:
+                print("Branching at Period:", branch_time, "| Parent:", self.branch[0])
+            else:
+                rewind_results(args, self.checkpoint)
+                print("Resuming at Period:", args["time"])
+
+        # A branch is a new run under its own ids, only a resumed run keeps the checkpoints found under them
+        if not self.checkpoint or self.branch:
+            args["run"] = start_checkpoints(self.user_id, self.strategy_id, self.backtest_id, run_identity())
 
         print("Running Period:", self.period)
 
@@ -68,38 +113,27 @@ class BackTest(Process):
             if p % 100 == 0:
                 print(p)
 
-            new_prices = dict()
-            new_volumes = dict()
             new_shares = dict()
 
-            if p == 0:
-                for k, v in data[0][p].items():
-                    new_prices[k] = v
+            if self.branch and p == branch_time:
+                start_branch(args, (self.user_id, self.strategy_id, self.branch[0]), branch_settings)
 
-                for k, v in data[1][p].items():
-                    new_volumes[k] = v
+            market_data.advance(p)
 
-                args["funds"].append(initial_funds)
+            if p == 0:
+                args["funds"].append(args["initial_funds"])
 
             else:
-                for k, v in args["prices"][p - 1].items():
-                    new_prices[k] = v
-
-                for k, v in args["volumes"][p - 1].items():
-                    new_volumes[k] = v
-
                 for k, v in args["shares"][p - 1].items():
                     new_shares[k] = v
 
                 args["funds"].append(args["funds"][p - 1])
 
-            args["prices"].append(new_prices)
-            args["volumes"].append(new_volumes)
             args["shares"].append(new_shares)
 
             args["buy_count"].append(0)
             args["sell_count"].append(0)
-            args["trade_signals"].append(list())
+            args["trade_signals"].append(SignalBatch())
 
             ts[0].start()
             calc_universe(args)
@@ -115,15 +149,27 @@ class BackTest(Process):
             ts[3].end()
             ts[4].start()
             calc_stats(args)
+            check_stop(args)
             ts[4].end()
             ts[5].start()
-            push_data(args)
+            if p >= branch_time:
+                push_data(args)
+
+                # Snapshots the completed period, the last period and pruned runs need no resuming
+                interval = args["checkpoint_interval"]
+
+                if interval and (p + 1) % interval == 0 and p + 1 < self.period and not args.get("pruned"):
+                    push_checkpoint(args)
             ts[5].end()
 
             p += 1
 
             args["time"] = p
 
+            if args.get("pruned"):
+                print("Pruned at Period:", p - 1, "|", args["pruned"])
+                break
+
         ts[6].end()
 
         print("-----Finished Backtest:", "|", self.user_id, self.strategy_id, self.backtest_id, "|-----")
@@ -133,16 +179,16 @@ class BackTest(Process):
         total_period = args["period"]
         final_funds = args["funds"][args["time"] - 1]
         final_shares = args["shares"][args["time"] - 1]
-        final_balance = calc_balance(args["period"] - 1, args["prices"], final_funds, final_shares)
-        net = final_balance - initial_funds
+        final_balance = args["portfolio"].balance()
+        net = final_balance - args["initial_funds"]
 
         print()
         print("Total Period:", total_period)
-        print("Initial Balance:", initial_funds)
+        print("Initial Balance:", args["initial_funds"])
         print("Remaining Funds:", final_funds)
         print("Final Balance:", final_balance)
         print("Net:", net)
-        print("Final Shares:", final_shares)
+        print("Final Shares:", {market_data.registry.symbol_of(s): c for s, c in final_shares.items()})
 
         for s, _ in final_shares.items():
-            print(s, ":", args["prices"][args["period"] - 1][s])
+            print(market_data.registry.symbol_of(s), ":", args["prices"][args["time"] - 1][s])
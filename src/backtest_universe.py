@@ -0,0 +1,181 @@
+import operator
+
+import numpy as np
+
+NO_SYMBOLS = np.empty(0, dtype=np.intp)
+
+DEFAULT_UNIVERSE = "symbol_length == 1"
+
+# Symbol fields never change during a run, market fields are re-evaluated from the period's price and volume rows
+STATIC_FIELDS = ("symbol_length",)
+MARKET_FIELDS = ("price", "volume", "dollar_volume")
+
+OPERATORS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le, "==": operator.eq, "!=": operator.ne}
+
+UNIVERSE_ALL = 0
+UNIVERSE_STATIC = 1     # Only symbol field comparisons, evaluated by stages without market data
+UNIVERSE_MARKET = 2     # Only market field comparisons and top clauses, applied on top of a static base mask
+
+
+def universe_delta(old_mask, new_mask):
+    if old_mask is None:
+        return np.flatnonzero(new_mask), NO_SYMBOLS
+
+    return np.flatnonzero(new_mask & ~old_mask), np.flatnonzero(old_mask & ~new_mask)
+
+
+def apply_universe_delta(mask, added, removed):
+    mask[added] = True
+    mask[removed] = False
+    return mask
+
+
+def _field_values(field, registry, prices, volumes, ids):
+    if field == "symbol_length":
+        return np.fromiter((len(registry.symbols[i]) for i in ids), dtype=np.int64, count=len(ids))
+    if field == "price":
+        return prices[ids]
+    if field == "volume":
+        return volumes[ids]
+    return prices[ids] * volumes[ids]
+
+
+class Comparison:
+    __slots__ = ['field', 'op', 'value', 'mask']
+
+    def __init__(self, field, op, value):
+        self.field = field
+        self.op = op
+        self.value = value
+        self.mask = None
+
+    def evaluate(self, registry, prices, volumes, ids):
+        # Only the given columns are re-evaluated, the rest keep their cached result
+        if self.mask is None or len(self.mask) != len(registry):
+            self.mask = np.zeros(len(registry), dtype=bool)
+
+        self.mask[ids] = OPERATORS[self.op](_field_values(self.field, registry, prices, volumes, ids), self.value)
+        return self.mask
+
+
+class Top:
+    __slots__ = ['field', 'count']
+
+    def __init__(self, field, count):
+        self.field = field
+        self.count = count
+
+    def evaluate(self, registry, prices, volumes, mask):
+        candidates = np.flatnonzero(mask)
+
+        if len(candidates) <= self.count:
+            return mask
+
+        values = _field_values(self.field, registry, prices, volumes, candidates)
+        result = np.zeros(len(mask), dtype=bool)
+        result[candidates[np.argpartition(-values, self.count - 1)[:self.count]]] = True
+        return result
+
+
+# Grammar: clause [and clause]*, clause := <field> <op> <number> | top <count> by <field>
+# Comparisons are ANDed together, top clauses then narrow the result in the order they are written
+def compile_universe(definition):
+    comparisons = []
+    tops = []
+
+    for clause in definition.lower().split(" and "):
+        tokens = clause.split()
+
+        if len(tokens) == 4 and tokens[0] == "top" and tokens[2] == "by" and tokens[3] in MARKET_FIELDS + STATIC_FIELDS:
+            tops.append(Top(tokens[3], int(tokens[1])))
+        elif len(tokens) == 3 and tokens[0] in MARKET_FIELDS + STATIC_FIELDS and tokens[1] in OPERATORS:
+            comparisons.append(Comparison(tokens[0], tokens[1], float(tokens[2])))
+        else:
+            raise ValueError("Invalid universe clause: " + clause)
+
+    return comparisons, tops
+
+
+# Universe definition compiled into a boolean mask over symbol ids
+# Symbol comparisons are only recomputed when the registry changes, market comparisons only for columns whose price or volume changed
+class UniverseMask:
+    __slots__ = ['definition', 'static', 'market', 'tops', 'key', 'static_mask', 'last_prices', 'last_volumes', 'last_base', 'base_ids', 'base_mask', 'mask', 'ids']
+
+    def __init__(self, definition=DEFAULT_UNIVERSE, parts=UNIVERSE_ALL):
+        self.definition = definition
+        comparisons, tops = compile_universe(definition)
+
+        self.static = [c for c in comparisons if c.field in STATIC_FIELDS] if parts != UNIVERSE_MARKET else []
+        self.market = [c for c in comparisons if c.field in MARKET_FIELDS] if parts != UNIVERSE_STATIC else []
+        self.tops = tops if parts != UNIVERSE_STATIC else []
+
+        self.key = None
+        self.static_mask = None
+        self.last_prices = None
+        self.last_volumes = None
+        self.last_base = None
+        self.base_ids = None
+        self.base_mask = None
+        self.mask = None
+        self.ids = NO_SYMBOLS
+
+    def uses_market_data(self):
+        return bool(self.market or self.tops)
+
+    # Returns the (added, removed) symbol ids, both empty when the universe did not change
+    # base optionally restricts the universe to a mask computed upstream, e.g. by a stage evaluating the static part
+    def update(self, registry, prices=None, volumes=None, base=None):
+        changed = False
+
+        if registry.digest != self.key:
+            self.key = registry.digest
+            self.static_mask = np.ones(len(registry), dtype=bool)
+            all_ids = np.arange(len(registry))
+
+            for c in self.static:
+                self.static_mask &= c.evaluate(registry, prices, volumes, all_ids)
+
+            self.last_prices = None
+            changed = True
+
+        if base is not self.last_base:
+            self.last_base = base
+            changed = True
+
+        mask = self.static_mask if base is None else self.static_mask & base
+
+        if self.uses_market_data():
+            if self.last_prices is None:
+                dirty = np.arange(len(registry))
+            else:
+                dirty = np.flatnonzero((prices != self.last_prices) | (volumes != self.last_volumes))
+
+            if len(dirty) or changed:
+                self.last_prices = np.array(prices)
+                self.last_volumes = np.array(volumes)
+
+                for c in self.market:
+                    mask = mask & c.evaluate(registry, prices, volumes, dirty)
+
+                for t in self.tops:
+                    mask = t.evaluate(registry, prices, volumes, mask)
+            else:
+                mask = self.mask
+
+        added, removed = universe_delta(self.mask, mask)
+
+        if self.mask is None or len(added) or len(removed):
+            self.mask = mask
+            self.ids = np.flatnonzero(mask)
+
+        return added, removed
+
+    # Applies the definition on top of an upstream universe given as symbol ids and returns the resulting ids
+    def restrict(self, registry, base_ids, prices, volumes):
+        if self.base_ids is None or not np.array_equal(base_ids, self.base_ids):
+            self.base_ids = np.array(base_ids, dtype=np.intp)
+            self.base_mask = np.zeros(len(registry), dtype=bool)
+            self.base_mask[self.base_ids] = True
+
+        self.update(registry, prices, volumes, self.base_mask)
+        return self.ids
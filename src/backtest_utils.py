@@ -1,13 +1,38 @@
+import os
 import json
+import struct
+import random
+import hashlib
+import tempfile
+import numpy as np
 from random import randint
 from noise import pnoise3
-from time import time, sleep
-from selenium import webdriver
-from bs4 import BeautifulSoup, SoupStrainer
-from multiprocessing import Process, Manager
+from time import time
+from multiprocessing import Process
 
 symbol_list_cache = None
+symbol_registry_cache = None
 seed = (time() * 1000 % 1000000)
+rng = np.random.default_rng(int(seed))
+
+
+# Restarts the random stream shared by price generation and strategies, runs reset to the same value draw the same numbers
+def reset_rng(value):
+    global rng
+    rng = np.random.default_rng(value)
+
+
+# Every random stream a run draws from, restoring a captured state continues the run with the same numbers
+def get_rng_state():
+    return {"seed": seed, "numpy": rng.bit_generator.state, "python": random.getstate()}
+
+
+def set_rng_state(state):
+    global seed, rng
+    seed = state["seed"]
+    rng = np.random.default_rng()
+    rng.bit_generator.state = state["numpy"]
+    random.setstate(state["python"])
 
 
 def calc_balance(time, prices, funds, shares):
@@ -29,209 +54,407 @@ def fetch_symbol_list():
     return result
 
 
-def fetch_symbol_price_change(time, prices, volumes, s):
-    symbols = fetch_symbol_list()
-    old_price = get_price(time, prices, s)
-    new_price = gen_price(time, symbols.index(s), old_price)
+# Interns every symbol to a dense int id, ids double as column indices into the market data arrays
+class SymbolRegistry:
+    __slots__ = ['symbols', 'ids', 'digest']
+
+    def __init__(self, symbols):
+        # Duplicate entries in the symbols file share the id of their first occurrence
+        self.symbols = list(dict.fromkeys(symbols))
+        self.ids = {s: i for i, s in enumerate(self.symbols)}
+        self.digest = hash_symbols(self.symbols)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, symbol):
+        return symbol in self.ids
+
+    def id_of(self, symbol):
+        return self.ids[symbol]
+
+    def symbol_of(self, symbol_id):
+        return self.symbols[int(symbol_id)]
+
+    def ids_of(self, symbols):
+        return [self.ids[s] for s in symbols]
+
+    def symbols_of(self, symbol_ids):
+        return [self.symbols[int(i)] for i in symbol_ids]
+
+
+def hash_symbols(symbols):
+    return hashlib.sha1("\n".join(symbols).encode()).digest()
+
+
+def fetch_symbol_registry():
+    global symbol_registry_cache
 
-    price_change = new_price - old_price
+    if symbol_registry_cache:
+        return symbol_registry_cache
 
-    prices[time][s] = new_price
+    symbol_registry_cache = SymbolRegistry(fetch_symbol_list())
+    return symbol_registry_cache
 
-    # Adding entropy to stock volume
 
-    volume = get_volume(time, volumes, s)
+# JSON turns int dict keys into strings, restores symbol id keys on shares received from other stages or files
+def unpack_shares(shares):
+    return {int(s): c for s, c in shares.items()}
 
-    if volume > 0:
-        op_type = (-1 if price_change > 0 else 1)
-        change_perc = abs(price_change / old_price)
-        multiplier = (randint(0, int(round(volume * change_perc))))
-        volumes[time][s] += op_type * multiplier
 
-    # Clamp volume to zero
-    if get_volume(time, volumes, s) <= 0:
-        volumes[time][s] = 0
+# Generates the next price and volume for every symbol in indices in one pass over the period row
+# Replayed rows are already filled from historical data and are compared against the previous period instead
+# Period 0 is compared against first_prices, the initial snapshot the run started from, or against itself without one
+def fetch_price_changes(time, prices, volumes, indices, replay=False, first_prices=None):
+    price_row = prices[time]
+    volume_row = volumes[time]
 
-    return old_price, new_price, price_change
+    if replay:
+        if time:
+            old_prices = prices[time - 1][indices]
+        else:
+            old_prices = (price_row if first_prices is None else first_prices)[indices]
+
+        new_prices = price_row[indices]
+        return old_prices, new_prices, new_prices - old_prices
+
+    old_prices = price_row[indices]
+    new_prices = gen_prices(time, indices, old_prices)
+
+    price_row[indices] = new_prices
+    volume_row[indices] = gen_volumes(old_prices, new_prices, volume_row[indices])
+
+    return old_prices, new_prices, new_prices - old_prices
 
 
 init_prices = None
 init_volumes = None
 
+SYMBOL_DATA_PATH = "symbol_data"
+SYMBOL_CACHE_PATH = "symbol_data.bin"
+SYMBOL_CACHE_MAGIC = b"BTSD"
+SYMBOL_CACHE_VERSION = 2
 
-def assure_init_data():
-    global init_prices, init_volumes
+# Seconds after which a symbol's cached data is refetched, None keeps cached data indefinitely
+SYMBOL_DATA_MAX_AGE = None
 
-    if init_prices and init_volumes:
-        print("Returning memory cached data")
-        return init_prices, init_volumes
+# Seconds before a symbol which failed to fetch is tried again, None only retries it on an explicit refresh
+SYMBOL_RETRY_INTERVAL = 24 * 60 * 60
+
+# Magic, Version, Symbol Count, Symbol List SHA1, Symbol Names Size
+SYMBOL_CACHE_HEADER = struct.Struct("<4sII20sI")
 
-    init_prices = list()
-    init_prices.append(dict())
-    init_volumes = list()
-    init_volumes.append(dict())
 
-    # Attempt to fetch cached data from disk
+def _align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+# Binary Layout: Header | Newline Joined Symbol Names | float64 Prices[n] | int64 Volumes[n] | float64 Fetch Times[n]
+# Arrays are 8 byte aligned and ordered by symbol id, Version 1 caches have no fetch times
+# A fetch time is positive once fetched, zero before the first attempt and the negated time of the last failed attempt otherwise
+def save_symbol_cache(registry, prices, volumes, fetch_times, path=SYMBOL_CACHE_PATH):
+    names = "\n".join(registry.symbols).encode()
+    header = SYMBOL_CACHE_HEADER.pack(SYMBOL_CACHE_MAGIC, SYMBOL_CACHE_VERSION, len(registry), registry.digest, len(names))
+    data_offset = _align(len(header) + len(names))
+
+    # Written to a temporary file and renamed so readers never map a partially written cache
+    # Every writer gets a file of its own, processes refreshing the cache at the same time never rename each other's
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(os.path.abspath(path)))
+
     try:
-        with open("symbol_data", "r") as f:
-            print("Loading cached price data")
-            packed_data = json.load(f)
-            init_prices[0] = packed_data["price_data"]
-            init_volumes[0] = packed_data["volume_data"]
+        with os.fdopen(fd, "wb") as f:
+            os.fchmod(f.fileno(), 0o644)
+            f.write(header)
+            f.write(names)
+            f.write(b"\0" * (data_offset - len(header) - len(names)))
+            f.write(np.ascontiguousarray(prices, dtype=np.float64).tobytes())
+            f.write(np.ascontiguousarray(volumes, dtype=np.int64).tobytes())
+            f.write(np.ascontiguousarray(fetch_times, dtype=np.float64).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    os.replace(temp_path, path)
+
+
+def _read_symbol_cache_header(path):
+    try:
+        with open(path, "rb") as f:
+            header = f.read(SYMBOL_CACHE_HEADER.size)
+    except FileNotFoundError:
+        print("No Binary Symbol Cache Found")
+        return None
 
-            symbols = fetch_symbol_list()
+    if len(header) < SYMBOL_CACHE_HEADER.size or header[:4] != SYMBOL_CACHE_MAGIC:
+        print("Binary Symbol Cache Corrupted")
+        return None
 
-            flag = True
+    return SYMBOL_CACHE_HEADER.unpack(header)
 
-            for s in symbols:
-                if s not in init_prices[0].keys() or s not in init_volumes[0].keys():
-                    print("Symbol Data Incomplete or Corrupted")
-                    flag = False
-                    break
-            if flag:
-                print("Returning disk cached data")
-                return init_prices, init_volumes
-    except FileNotFoundError as e:
-        print("No Cached Price Data Found")
-    except KeyError as e:
-        print("Symbol Data Corrupted!")
 
-    # No cached symbol data available, Fetching Symbol Data
-    print("Fetching Symbol Data")
+# Maps the cache read-only, pages are shared between every process mapping the same file
+def load_symbol_cache(registry, path=SYMBOL_CACHE_PATH):
+    header = _read_symbol_cache_header(path)
 
-    symbols = fetch_symbol_list()
-    symbols_count = len(symbols)
+    if not header:
+        return None
 
-    batches = 4
-    batch_data = []
+    _, version, count, digest, names_size = header
 
-    manager = Manager()
+    # A single hash comparison replaces checking every symbol against the cached keys
+    if version != SYMBOL_CACHE_VERSION or count != len(registry) or digest != registry.digest:
+        print("Binary Symbol Cache Outdated")
+        return None
 
-    batch_status = manager.list()
+    data_offset = _align(SYMBOL_CACHE_HEADER.size + names_size)
+    prices = np.memmap(path, dtype=np.float64, mode="r", offset=data_offset, shape=(count,))
+    volumes = np.memmap(path, dtype=np.int64, mode="r", offset=data_offset + 8 * count, shape=(count,))
+    fetch_times = np.memmap(path, dtype=np.float64, mode="r", offset=data_offset + 16 * count, shape=(count,))
 
-    for i in range(batches):
-        batch_status.append(0)
+    return prices, volumes, fetch_times
 
-    cur_sublist = None
 
-    for i in range(len(symbols)):
-        if i % int(symbols_count / batches) == 0:
-            batch_data.append([])
-            cur_sublist = batch_data[len(batch_data) - 1]
-        cur_sublist.append(symbols[i])
+# Reads a cache built for any symbol list, returns (symbols, prices, volumes, fetch times) for merging
+def read_symbol_cache(path=SYMBOL_CACHE_PATH):
+    header = _read_symbol_cache_header(path)
 
-    ps = []
+    if not header:
+        return None
 
-    for batch_index in range(batches):
-        d = batch_data[batch_index]
-        p = Process(target=_fetch_data, args=(d, batch_index, batch_status))
-        p.start()
-        ps.append(p)
+    _, version, count, _, names_size = header
 
-    sleep(5)
+    with open(path, "rb") as f:
+        data = f.read()
 
-    is_processing = True
+    data_offset = _align(SYMBOL_CACHE_HEADER.size + names_size)
+    symbols = data[SYMBOL_CACHE_HEADER.size:SYMBOL_CACHE_HEADER.size + names_size].decode().split("\n")
+    prices = np.frombuffer(data, dtype=np.float64, count=count, offset=data_offset)
+    volumes = np.frombuffer(data, dtype=np.int64, count=count, offset=data_offset + 8 * count)
 
-    while is_processing:
-        is_processing = False
-        for batch_index in range(batches):
-            prog = batch_status[batch_index] * 100
-            print(f"Batch Progress: {prog}% complete for batch {batch_index}")
+    if version >= 2:
+        fetch_times = np.frombuffer(data, dtype=np.float64, count=count, offset=data_offset + 16 * count)
+    else:
+        fetch_times = np.full(count, os.path.getmtime(path))
 
-            if prog < 100:
-                is_processing = True
+    return symbols, prices, volumes, fetch_times
 
-        print("\n")
 
-        try:
-            sleep(3)
-        except KeyboardInterrupt as e:
-            exit(0)
+# Symbols to fetch: never attempted, older than max_age, or failed more than retry_interval seconds ago
+def symbols_due(fetch_times, now, max_age=SYMBOL_DATA_MAX_AGE, retry_interval=SYMBOL_RETRY_INTERVAL):
+    due = fetch_times == 0
 
-    for batch_index in range(batches):
-        ps[batch_index].join()
+    if max_age is not None:
+        due |= (fetch_times > 0) & (fetch_times < now - max_age)
 
-    print("Finished Fetching Symbol Data")
+    if retry_interval is not None:
+        due |= (fetch_times < 0) & (-fetch_times <= now - retry_interval)
 
-    packed_data = {"price_data": init_prices[0].copy(), "volume_data": init_volumes[0].copy()}
+    return due
 
-    # Save data
-    with open("symbol_data", "w") as f:
-        json.dump(packed_data, f)
 
-    print("Returning Web-Scraped Data")
+# Returns initial (prices, volumes) arrays ordered by symbol id
+def assure_init_data(max_age=SYMBOL_DATA_MAX_AGE):
+    global init_prices, init_volumes
+
+    if init_prices is not None and init_volumes is not None:
+        print("Returning memory cached data")
+        return init_prices, init_volumes
+
+    registry = fetch_symbol_registry()
+    cached = load_symbol_cache(registry)
+
+    # Symbols which failed to fetch are retried once their retry interval passed, even when cached data never expires
+    if cached and not symbols_due(cached[2], time(), max_age).any():
+        print("Returning disk cached data")
+        init_prices, init_volumes, _ = cached
+        return init_prices, init_volumes
+
+    refresh_symbol_data(registry, max_age)
+
+    init_prices, init_volumes, _ = load_symbol_cache(registry)
     return init_prices, init_volumes
 
 
-def _fetch_data(symbols, batch_index, batch_status):
-    global init_prices, init_volumes
+# Fetches only symbols which are missing from or stale in the existing cache and merges them in
+# An explicit refresh passes retry_interval=0 to retry every symbol which failed to fetch
+def refresh_symbol_data(registry, max_age=SYMBOL_DATA_MAX_AGE, path=SYMBOL_CACHE_PATH, retry_interval=SYMBOL_RETRY_INTERVAL):
+    symbols_count = len(registry)
 
-    if not init_prices or not init_volumes:
-        print("init_prices and/or init_volumes not properly instantiated. Exiting")
-        quit(0)
+    prices = np.zeros(symbols_count, dtype=np.float64)
+    volumes = np.zeros(symbols_count, dtype=np.int64)
+    fetch_times = np.zeros(symbols_count, dtype=np.float64)   # Zero marks a missing symbol, see save_symbol_cache
 
-    symbols_count = len(symbols)
-    print("Starting Batch:", batch_index, " Batch Size:", symbols_count)
-    options = webdriver.ChromeOptions()
-    options.add_argument('headless')
-    options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+    # Attempt to reuse the binary cache, falling back to migrating the legacy JSON cache
+    previous = read_symbol_cache(path) or _load_legacy_symbol_data()
 
-    try:
-        driver = webdriver.Chrome('chromedriver', chrome_options=options)
-    except KeyboardInterrupt as e:
-        quit(0)
+    if previous:
+        for s, price, volume, fetch_time in zip(*previous):
+            if s in registry:
+                i = registry.id_of(s)
+                prices[i] = price
+                volumes[i] = volume
+                fetch_times[i] = fetch_time
+
+    now = time()
+    symbols = registry.symbols_of(np.flatnonzero(symbols_due(fetch_times, now, max_age, retry_interval)))
+    print("Refreshing Symbol Data:", len(symbols), "of", symbols_count, "symbols missing or stale")
+
+    if symbols:
+        price_data, volume_data = _scrape_symbol_data(symbols)
+
+        for s in symbols:
+            i = registry.id_of(s)
+
+            if not price_data.get(s) or volume_data.get(s) is None:
+                # Falls back to generated data, the failure is recorded so the symbol is only retried after the retry interval
+                print("Failed to Fetch Symbol Data:", s)
+
+                if fetch_times[i] == 0:
+                    prices[i] = gen_init_price()
+                    volumes[i] = gen_volume()
+
+                if fetch_times[i] <= 0:
+                    fetch_times[i] = -now
+                continue
+
+            prices[i] = price_data[s]
+            volumes[i] = volume_data[s]
+            fetch_times[i] = now
 
+    save_symbol_cache(registry, prices, volumes, fetch_times, path)
+
+
+def _load_legacy_symbol_data():
     try:
-        for s_index in range(symbols_count):
-            s = symbols[s_index]
+        with open(SYMBOL_DATA_PATH, "r") as f:
+            print("Loading cached price data")
+            packed_data = json.load(f)
+            price_data = packed_data["price_data"]
+            volume_data = packed_data["volume_data"]
+    except FileNotFoundError as e:
+        print("No Cached Price Data Found")
+        return None
+    except KeyError as e:
+        print("Symbol Data Corrupted!")
+        return None
 
-            url = "finance.yahoo.com/quote/" + s
+    # Incomplete legacy data is still merged, missing symbols are fetched individually
+    symbols = [s for s in price_data if s in volume_data]
+    fetch_time = os.path.getmtime(SYMBOL_DATA_PATH)
 
-            driver.get("http://" + url)
+    return symbols, [price_data[s] for s in symbols], [volume_data[s] for s in symbols], [fetch_time] * len(symbols)
 
-            r = driver.page_source
 
-            data = BeautifulSoup(r, "html.parser", parse_only=SoupStrainer("span"))
+def _scrape_symbol_data(symbols):
+    # Imported on demand so backtest processes never load the scraping dependencies
+    from src.backtest_fetcher import fetch_quotes
+
+    print("Fetching Symbol Data")
+
+    price_data, volume_data = fetch_quotes(symbols)
+
+    print("Finished Fetching Symbol Data")
+
+    print("Returning Web-Scraped Data")
+    return price_data, volume_data
+
+
+FSYNC_NEVER = 0        # Leave durability to the OS, only flush Python's buffer
+FSYNC_ON_FLUSH = 1     # fsync once per batched flush
+FSYNC_ALWAYS = 2       # Flush and fsync after every record
 
-            price_tag = data.find("span", {"class": "Trsdu(0.3s) Fw(b) Fz(36px) Mb(-4px) D(ib)", "data-reactid": 52})
-            volume_tag = data.find("span", {"class": "Trsdu(0.3s)", "data-reactid": 72})
 
-            price = None
-            volume = None
+def result_path(user_id, strategy_id, backtest_id):
+    return "./backtest_results/{user_id}-{strategy_id}-{backtest_id}".format(user_id=user_id, strategy_id=strategy_id, backtest_id=backtest_id)
 
-            if price_tag:
-                price = float(price_tag.text.replace(',', ''))
 
-            if volume_tag:
-                volume = int(volume_tag.text.replace(',', ''))
+# Streams one NDJSON record per period instead of re-serializing every previous period
+class ResultWriter:
+    __slots__ = ['path', 'file', 'flush_interval', 'fsync_policy', 'pending']
 
-            if not price:
-                price = gen_price(0, s_index)
+    def __init__(self, user_id, strategy_id, backtest_id, flush_interval=100, fsync_policy=FSYNC_ON_FLUSH, mode="overwrite"):
+        self.path = result_path(user_id, strategy_id, backtest_id)
+        self.file = open(self.path, "a" if mode == "append" else "w")
+        self.flush_interval = max(1, flush_interval)
+        self.fsync_policy = fsync_policy
+        self.pending = 0
 
-            if not volume:
-                volume = gen_volume()
+    def write(self, record):
+        self.file.write(json.dumps(record))
+        self.file.write("\n")
+        self.pending += 1
 
-            init_prices[0][s] = price
-            init_volumes[0][s] = volume
-            batch_status[batch_index] = (s_index + 1) / symbols_count
-            sleep(1)
+        if self.fsync_policy == FSYNC_ALWAYS or self.pending >= self.flush_interval:
+            self.flush()
 
-        driver.close()
-    except KeyboardInterrupt as e:
-        driver.quit()
-        quit(0)
+    def flush(self):
+        self.file.flush()
+
+        if self.fsync_policy != FSYNC_NEVER:
+            os.fsync(self.file.fileno())
+
+        self.pending = 0
+
+    # Byte offset of everything written so far, flushed first so the file on disk holds every record before it
+    def tell(self):
+        self.flush()
+        return self.file.tell()
+
+    def close(self):
+        if self.file.closed:
+            return
+
+        self.flush()
+        self.file.close()
 
 
 # Overwrite Mode: Each period overwrites the previous periods data
-# Append Mode: Each period appends data to file. Previous Runs are stored. Not Supported Format.
+# Append Mode: Each record is appended to the file as a single NDJSON line
 def save_data(user_id, strategy_id, backtest_id, data, mode="overwrite"):
-    with open("./backtest_results/{user_id}-{strategy_id}-{backtest_id}".format(user_id=user_id, strategy_id=strategy_id, backtest_id=backtest_id), "w" if mode == "overwrite" else ("a" if mode == "append" else "w")) as f:
+    if mode == "append":
+        writer = ResultWriter(user_id, strategy_id, backtest_id, flush_interval=len(data), mode=mode)
+        for d in data:
+            writer.write(d)
+        writer.close()
+        return
+
+    with open(result_path(user_id, strategy_id, backtest_id), "w") as f:
         json.dump(data, f)
 
 
-def load_data(user_id, strategy_id, backtest_id):
-    with open("./backtest_results/{user_id}-{strategy_id}-{backtest_id}".format(user_id=user_id, strategy_id=strategy_id, backtest_id=backtest_id)) as f:
-        return json.load(f)
+# Reads both the legacy single JSON list format and the streamed NDJSON format
+# _branches holds the runs whose results are being read, a branch referring back to one of them is rejected
+def load_data(user_id, strategy_id, backtest_id, _branches=()):
+    with open(result_path(user_id, strategy_id, backtest_id)) as f:
+        if f.read(1) == "[":
+            f.seek(0)
+            return json.load(f)
+
+        f.seek(0)
+        result = []
+
+        for l in f:
+            if not l.strip():
+                continue
+            try:
+                result.append(json.loads(l))
+            except json.JSONDecodeError:
+                # Partially written trailing record from an interrupted run
+                break
+
+        # Branched runs only store their own periods, the shared prefix is read from the parent's results
+        if result and "branch_of" in result[0]:
+            run = (str(user_id), str(strategy_id), str(backtest_id))
+            parent = result[0]["branch_of"]
+
+            if tuple(str(i) for i in parent) in _branches + (run,):
+                raise ValueError("Branch refers back to itself: " + "-".join(run))
+
+            return load_data(*parent, _branches=_branches + (run,))[:result[0]["branch_time"]] + result[1:]
+
+        return result
 
 
 def gen_price(time, index, old_price):
@@ -244,37 +467,196 @@ def gen_price(time, index, old_price):
     # return old_price + sin(self.time / scale)
 
 
-def gen_volume():
-    min = 10
-    max = 10000
-    return randint(min, max)
+# Vectorized gen_price, noise values are identical to pnoise3 and the shocks are drawn from rng
+# noise_seed and generator default to the run's seed and rng, Monte Carlo paths pass their own
+def gen_prices(time, indices, old_prices, noise_seed=None, generator=None):
+    min_price = 0.001
+    scale = 50
+    generator = generator or rng
+    shock_range = np.maximum(1, np.rint(0.10 * old_prices * 1000).astype(np.int64))
+    new_prices = old_prices + pnoise3_array(time / scale, indices, seed if noise_seed is None else noise_seed) * generator.integers(1, shock_range, endpoint=True) / 1000
+    return np.maximum(new_prices, min_price)
 
 
-def get_price(time_index, prices, symbol):
-    return prices[time_index][symbol]
+# Adds entropy to stock volumes proportional to the price change, clamped to zero
+def gen_volumes(old_prices, new_prices, volumes, generator=None):
+    generator = generator or rng
+    price_change = new_prices - old_prices
+    op_type = np.where(price_change > 0, -1, 1)
+    change_range = np.rint(volumes * np.abs(price_change / old_prices)).astype(np.int64)
+    multiplier = np.where(volumes > 0, generator.integers(0, np.maximum(change_range, 0), endpoint=True), 0)
+    return np.maximum(volumes + op_type * multiplier, 0)
+
+
+def _strategy_targets(old_prices, new_prices, volumes, positions, transaction_cost, max_sell_out_percentage, max_buy_out_percentage, generator):
+    # Sell
+    sells = (new_prices < old_prices) & (positions > 0)
+    sell_out_capacity = (max_sell_out_percentage * positions).astype(np.int64)
+    sell_targets = np.where(sells, generator.integers(0, np.maximum(sell_out_capacity, 0), endpoint=True), 0)
+    sells &= (sell_targets > 0) & (sell_targets * new_prices >= transaction_cost)
+
+    # Buy
+    buys = new_prices > old_prices
+    max_buy_out_capacity = (max_buy_out_percentage * volumes).astype(np.int64)
+    buy_targets = np.where(buys, generator.integers(0, np.maximum(max_buy_out_capacity, 0), endpoint=True), 0)
+    buys &= buy_targets > 0
+
+    cash_flow = np.where(sells, sell_targets * new_prices - transaction_cost, 0) - np.where(buys, buy_targets * new_prices + transaction_cost, 0)
+    return sells, sell_targets, buys, buy_targets, cash_flow
+
+
+# Batched strategy over the universe, positions are the held shares of every universe symbol
+# Returns (signal_types, quantities) aligned with the inputs, signal type 0 means no signal
+# Buys are funded in universe order from a running balance buffer, the same as walking the universe symbol by symbol
+def strategy_kernel(old_prices, new_prices, volumes, positions, funds, transaction_cost, max_sell_out_percentage=0.10, max_buy_out_percentage=0.10):
+    signal_types = np.zeros(len(new_prices), dtype=np.int8)
+    quantities = np.zeros(len(new_prices), dtype=np.int64)
 
+    sells, sell_targets, buys, buy_targets, cash_flow = _strategy_targets(old_prices, new_prices, volumes, positions, transaction_cost, max_sell_out_percentage, max_buy_out_percentage, rng)
 
-def get_volume(time_index, volumes, symbol):
-    return volumes[time_index][symbol]
+    # Balance buffer seen by every symbol as long as each buy before it was filled in full
+    balance_buffer = funds + np.concatenate(([0], np.cumsum(cash_flow)[:-1]))
+    buy_capacity = np.trunc((balance_buffer - transaction_cost) / new_prices)
 
+    # Everything up to the first buy that cannot be funded in full is exact, the tail is walked with the actual buffer
+    underfunded = np.flatnonzero(buys & (buy_targets > buy_capacity))
+    cutoff = underfunded[0] if len(underfunded) else len(new_prices)
 
-def gen_sell_signal(symbol, quantity):
-    return TradeSignal(signal_type=-1, symbol=symbol, quantity=quantity)
+    signal_types[:cutoff][sells[:cutoff]] = -1
+    signal_types[:cutoff][buys[:cutoff]] = 1
+    quantities[:cutoff] = np.where(sells[:cutoff], sell_targets[:cutoff], np.where(buys[:cutoff], buy_targets[:cutoff], 0))
 
+    if cutoff < len(new_prices):
+        buffer = float(balance_buffer[cutoff])
+        tail = zip(range(cutoff, len(new_prices)), sells[cutoff:].tolist(), buys[cutoff:].tolist(),
+                   sell_targets[cutoff:].tolist(), buy_targets[cutoff:].tolist(), new_prices[cutoff:].tolist())
 
-def gen_buy_signal(symbol, quantity):
-    return TradeSignal(signal_type=1, symbol=symbol, quantity=quantity)
+        for i, sell, buy, sell_target, buy_target, new_price in tail:
+            if sell:
+                signal_types[i] = -1
+                quantities[i] = sell_target
+                buffer += sell_target * new_price - transaction_cost
+            elif buy:
+                buy_target = min(buy_target, int((buffer - transaction_cost) / new_price))
+
+                if buy_target > 0:
+                    signal_types[i] = 1
+                    quantities[i] = buy_target
+                    buffer -= buy_target * new_price + transaction_cost
+
+    return signal_types, quantities
 
 
-class TradeSignal:
+# strategy_kernel over (path x symbol) arrays with one funds value per path, every path is funded independently
+# Symbols before the first underfunded buy of any path come from the cumulative sum, the rest are scanned column by column across all paths
+def strategy_kernel_paths(old_prices, new_prices, volumes, positions, funds, transaction_cost, max_sell_out_percentage=0.10, max_buy_out_percentage=0.10, generator=None):
+    sells, sell_targets, buys, buy_targets, cash_flow = _strategy_targets(old_prices, new_prices, volumes, positions, transaction_cost, max_sell_out_percentage, max_buy_out_percentage, generator or rng)
 
-    def __init__(self, signal_type, symbol, quantity):
-        self.signal_type = signal_type
-        self.symbol = symbol
-        self.quantity = quantity
+    balance_buffer = funds[:, None] + np.concatenate((np.zeros((len(funds), 1)), np.cumsum(cash_flow, axis=1)[:, :-1]), axis=1)
+    buy_capacity = np.trunc((balance_buffer - transaction_cost) / new_prices)
+    underfunded = buys & (buy_targets > buy_capacity)
 
-    def __str__(self):
-        return "{signal_type}, {symbol}, {quantity}".format(signal_type=("Buy" if self.signal_type == 1 else "Sell"), symbol=self.symbol, quantity=self.quantity)
+    signal_types = np.where(sells, -1, np.where(buys, 1, 0)).astype(np.int8)
+    quantities = np.where(sells, sell_targets, np.where(buys, buy_targets, 0))
 
-    def __repr__(self):
-        return "<{signal_type}, {symbol}, {quantity}>".format(signal_type=("Buy" if self.signal_type == 1 else "Sell"), symbol=self.symbol, quantity=self.quantity)
+    start = int(np.where(underfunded.any(axis=1), underfunded.argmax(axis=1), new_prices.shape[1]).min()) if len(funds) else 0
+
+    if start < new_prices.shape[1]:
+        buffer = balance_buffer[:, start].copy()
+
+        for i in range(start, new_prices.shape[1]):
+            buffer += np.where(sells[:, i], sell_targets[:, i] * new_prices[:, i] - transaction_cost, 0)
+
+            buy_target = np.minimum(buy_targets[:, i], np.trunc((buffer - transaction_cost) / new_prices[:, i])).astype(np.int64)
+            filled = buys[:, i] & (buy_target > 0)
+
+            signal_types[:, i] = np.where(buys[:, i] & ~filled, 0, signal_types[:, i])
+            quantities[:, i] = np.where(buys[:, i], np.where(filled, buy_target, 0), quantities[:, i])
+            buffer -= np.where(filled, buy_target * new_prices[:, i] + transaction_cost, 0)
+
+    return signal_types, quantities
+
+
+PERLIN_PERMUTATION = np.array([
+    151, 160, 137, 91, 90, 15, 131, 13, 201, 95, 96, 53, 194, 233, 7, 225, 140, 36, 103, 30, 69, 142, 8, 99, 37, 240, 21, 10, 23,
+    190, 6, 148, 247, 120, 234, 75, 0, 26, 197, 62, 94, 252, 219, 203, 117, 35, 11, 32, 57, 177, 33, 88, 237, 149, 56, 87, 174,
+    20, 125, 136, 171, 168, 68, 175, 74, 165, 71, 134, 139, 48, 27, 166, 77, 146, 158, 231, 83, 111, 229, 122, 60, 211, 133, 230,
+    220, 105, 92, 41, 55, 46, 245, 40, 244, 102, 143, 54, 65, 25, 63, 161, 1, 216, 80, 73, 209, 76, 132, 187, 208, 89, 18, 169,
+    200, 196, 135, 130, 116, 188, 159, 86, 164, 100, 109, 198, 173, 186, 3, 64, 52, 217, 226, 250, 124, 123, 5, 202, 38, 147, 118,
+    126, 255, 82, 85, 212, 207, 206, 59, 227, 47, 16, 58, 17, 182, 189, 28, 42, 223, 183, 170, 213, 119, 248, 152, 2, 44, 154,
+    163, 70, 221, 153, 101, 155, 167, 43, 172, 9, 129, 22, 39, 253, 19, 98, 108, 110, 79, 113, 224, 232, 178, 185, 112, 104, 218,
+    246, 97, 228, 251, 34, 242, 193, 238, 210, 144, 12, 191, 179, 162, 241, 81, 51, 145, 235, 249, 14, 239, 107, 49, 192, 214, 31,
+    181, 199, 106, 157, 184, 84, 204, 176, 115, 121, 50, 45, 127, 4, 150, 254, 138, 236, 205, 93, 222, 114, 67, 29, 24, 72, 243,
+    141, 128, 195, 78, 66, 215, 61, 156, 180] * 2, dtype=np.int64)
+
+PERLIN_GRADIENTS = np.array([
+    [1, 1, 0], [-1, 1, 0], [1, -1, 0], [-1, -1, 0], [1, 0, 1], [-1, 0, 1], [1, 0, -1], [-1, 0, -1],
+    [0, 1, 1], [0, -1, 1], [0, 1, -1], [0, -1, -1], [1, 0, -1], [-1, 0, -1], [0, -1, 1], [0, 1, 1]], dtype=np.float32)
+
+
+# Per axis gradient components, three small lookups instead of gathering (..., 3) gradient rows
+PERLIN_GRADIENTS_X = np.ascontiguousarray(PERLIN_GRADIENTS[:, 0])
+PERLIN_GRADIENTS_Y = np.ascontiguousarray(PERLIN_GRADIENTS[:, 1])
+PERLIN_GRADIENTS_Z = np.ascontiguousarray(PERLIN_GRADIENTS[:, 2])
+
+
+def _perlin_grad(h, x, y, z):
+    h = h & 15
+    return x * PERLIN_GRADIENTS_X[h] + y * PERLIN_GRADIENTS_Y[h] + z * PERLIN_GRADIENTS_Z[h]
+
+
+def _perlin_lerp(t, a, b):
+    return a + t * (b - a)
+
+
+# Single octave pnoise3 over broadcast arrays, computed in float32 like the noise C extension so results match exactly
+def pnoise3_array(x, y, z, repeat=1024):
+    # Inputs broadcast lazily, hashes and fades of an axis are only computed over that axis' own shape
+    x, y, z = np.asarray(x, np.float32), np.asarray(y, np.float32), np.asarray(z, np.float32)
+    perm = PERLIN_PERMUTATION
+    one = np.float32(1)
+
+    i = np.floor(np.fmod(x, np.float32(repeat))).astype(np.int64)
+    j = np.floor(np.fmod(y, np.float32(repeat))).astype(np.int64)
+    k = np.floor(np.fmod(z, np.float32(repeat))).astype(np.int64)
+    ii = np.fmod(i + 1, repeat) & 255
+    jj = np.fmod(j + 1, repeat) & 255
+    kk = np.fmod(k + 1, repeat) & 255
+    i &= 255
+    j &= 255
+    k &= 255
+
+    x = x - np.floor(x)
+    y = y - np.floor(y)
+    z = z - np.floor(z)
+    fx = x * x * x * (x * (x * 6 - 15) + 10)
+    fy = y * y * y * (y * (y * 6 - 15) + 10)
+    fz = z * z * z * (z * (z * 6 - 15) + 10)
+
+    a = perm[i]
+    aa = perm[a + j]
+    ab = perm[a + jj]
+    b = perm[ii]
+    ba = perm[b + j]
+    bb = perm[b + jj]
+
+    return _perlin_lerp(fz, _perlin_lerp(fy, _perlin_lerp(fx, _perlin_grad(perm[aa + k], x, y, z), _perlin_grad(perm[ba + k], x - one, y, z)),
+                                             _perlin_lerp(fx, _perlin_grad(perm[ab + k], x, y - one, z), _perlin_grad(perm[bb + k], x - one, y - one, z))),
+                            _perlin_lerp(fy, _perlin_lerp(fx, _perlin_grad(perm[aa + kk], x, y, z - one), _perlin_grad(perm[ba + kk], x - one, y, z - one)),
+                                             _perlin_lerp(fx, _perlin_grad(perm[ab + kk], x, y - one, z - one), _perlin_grad(perm[bb + kk], x - one, y - one, z - one))))
+
+
+def gen_init_price():
+    min = 1
+    max = 1000
+    return randint(min * 100, max * 100) / 100
+
+
+def gen_volume():
+    min = 10
+    max = 10000
+    return randint(min, max)
+
+
+def get_price(time_index, prices, symbol):
+    return prices[time_index][symbol]
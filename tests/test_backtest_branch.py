@@ -0,0 +1,47 @@
+import json
+import os
+
+import pytest
+
+import src.backtest_utils as backtest_utils
+from src.backtest_branch import branch_header
+from src.backtest_runner import next_backtest_id
+from src.backtest_synchronous import BackTest
+
+
+def test_backtest_ids_continue_after_the_runs_on_disk(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert next_backtest_id() == 0
+
+    os.makedirs("backtest_results")
+    os.makedirs("backtest_checkpoints/3-0-7")
+
+    for name in ("0-0-0", "3-0-4", "3-0-sweep.csv"):
+        open(os.path.join("backtest_results", name), "w").close()
+
+    assert next_backtest_id() == 8
+
+
+def test_branch_with_its_parents_id_is_rejected():
+    with pytest.raises(ValueError):
+        BackTest(990, 0, 5, period=10, checkpoint={}, branch=(5, 3))._run_backtest()
+
+
+def test_self_referencing_branch_results_are_rejected(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("backtest_results")
+
+    with open(backtest_utils.result_path(990, 0, 1), "w") as f:
+        f.write(json.dumps(branch_header((990, 0, 2), 1)) + "\n")
+
+    with open(backtest_utils.result_path(990, 0, 2), "w") as f:
+        f.write(json.dumps(branch_header((990, 0, 1), 1)) + "\n")
+
+    with open(backtest_utils.result_path(990, 0, 3), "w") as f:
+        f.write(json.dumps(branch_header((990, 0, 3), 1)) + "\n")
+
+    with pytest.raises(ValueError):
+        backtest_utils.load_data(990, 0, 3)
+
+    with pytest.raises(ValueError):
+        backtest_utils.load_data(990, 0, 1)
@@ -0,0 +1,72 @@
+import os
+import shutil
+
+import pytest
+
+import src.backtest_utils as backtest_utils
+from src.backtest_checkpoint import checkpoint_dir, latest_checkpoint, list_checkpoints
+from src.backtest_multiprocessing import BackTest as MultiprocessingBackTest
+from src.backtest_synchronous import BackTest as SynchronousBackTest
+
+USER_ID = 990
+PERIOD = 300
+INTERVAL = 100
+
+
+@pytest.fixture
+def backtest_ids():
+    ids = (10, 11)
+    yield ids
+
+    for backtest_id in ids:
+        if os.path.exists(backtest_utils.result_path(USER_ID, 0, backtest_id)):
+            os.remove(backtest_utils.result_path(USER_ID, 0, backtest_id))
+
+        shutil.rmtree(checkpoint_dir(USER_ID, 0, backtest_id), ignore_errors=True)
+
+
+def _results(backtest_id):
+    with open(backtest_utils.result_path(USER_ID, 0, backtest_id), "rb") as f:
+        return f.read()
+
+
+# Runs the backtest uninterrupted, leaves records of a crashed run after the latest checkpoint and resumes it with the given engine
+def _resume(engine, resume_engine, backtest_id):
+    backtest_utils.reset_rng(21)
+    engine(USER_ID, 0, backtest_id, period=PERIOD, checkpoint_interval=INTERVAL)._run_backtest()
+    full = _results(backtest_id)
+
+    assert list_checkpoints(USER_ID, 0, backtest_id) == [99, 199]
+
+    with open(backtest_utils.result_path(USER_ID, 0, backtest_id), "a") as f:
+        f.write("partial record\n")
+
+    checkpoint = latest_checkpoint(USER_ID, 0, backtest_id, 249)
+    assert checkpoint["time"] == 199
+
+    # The random streams are restored from the checkpoint, not from the state the process is left in
+    backtest_utils.reset_rng(99)
+    config = checkpoint["config"]
+    resume_engine(USER_ID, 0, backtest_id, period=config["period"], strategy=config["strategy"], checkpoint_interval=config["checkpoint_interval"], checkpoint=checkpoint)._run_backtest()
+
+    return full, _results(backtest_id)
+
+
+def test_resumed_synchronous_run_matches_the_uninterrupted_run(backtest_ids):
+    full, resumed = _resume(SynchronousBackTest, SynchronousBackTest, backtest_ids[0])
+    assert resumed == full
+
+
+def test_resumed_multiprocessing_run_matches_the_uninterrupted_run(backtest_ids):
+    full, resumed = _resume(MultiprocessingBackTest, MultiprocessingBackTest, backtest_ids[0])
+    assert resumed == full
+
+
+def test_multiprocessing_checkpoints_resume_in_the_synchronous_engine(backtest_ids):
+    full, resumed = _resume(MultiprocessingBackTest, SynchronousBackTest, backtest_ids[0])
+    assert resumed == full
+
+    # Both engines write the same results from the same seed
+    backtest_utils.reset_rng(21)
+    SynchronousBackTest(USER_ID, 0, backtest_ids[1], period=PERIOD, checkpoint_interval=0)._run_backtest()
+    assert _results(backtest_ids[1]) == full
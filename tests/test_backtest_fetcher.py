@@ -0,0 +1,54 @@
+import asyncio
+
+from aiohttp import web
+
+from src.backtest_fetcher import stream_quotes
+
+QUOTE_PAGE = ('<html><body><span class="Trsdu(0.3s) Fw(b) Fz(36px) Mb(-4px) D(ib)" data-reactid="52">1,234.50</span>'
+              '<span class="Trsdu(0.3s)" data-reactid="72">56,789</span></body></html>')
+
+
+async def _quote(request):
+    symbol = request.match_info["symbol"]
+
+    if symbol == "GOOD":
+        return web.Response(text=QUOTE_PAGE, content_type="text/html")
+
+    if symbol == "UNDECODABLE":
+        return web.Response(body=b"\xff\xfe\xfa", content_type="text/html", charset="utf-8")
+
+    if symbol == "MISSING":
+        return web.Response(status=404)
+
+    return web.Response(status=500)
+
+
+async def _stream_from_stub(symbols):
+    app = web.Application()
+    app.router.add_get("/quote/{symbol}", _quote)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    try:
+        url = "http://127.0.0.1:{}/quote/{{symbol}}".format(port)
+        return [q async for q in stream_quotes(symbols, concurrency=2, url=url, retries=1, backoff=0, timeout=5)]
+    finally:
+        await runner.cleanup()
+
+
+def test_stream_quotes_yields_every_symbol():
+    symbols = ["GOOD", "UNDECODABLE", "MISSING", "BROKEN", "GOOD2"]
+    quotes = asyncio.run(asyncio.wait_for(_stream_from_stub(symbols), 10))
+
+    assert sorted(q[0] for q in quotes) == sorted(symbols)
+
+    quotes = {s: (price, volume) for s, price, volume in quotes}
+    assert quotes["GOOD"] == (1234.5, 56789)
+    assert quotes["UNDECODABLE"] == (None, None)
+    assert quotes["MISSING"] == (None, None)
+    assert quotes["BROKEN"] == (None, None)
+    assert quotes["GOOD2"] == (None, None)
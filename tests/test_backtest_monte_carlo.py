@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from src.backtest_monte_carlo import _noise_offsets, run_monte_carlo, PathStreams
+from src.backtest_utils import pnoise3_array
+
+
+def _path_noise(seeds, periods=50, symbols=20):
+    offsets = _noise_offsets(np.asarray(seeds, dtype=np.int64))[:, None]
+    return np.stack([pnoise3_array(p / 50, np.arange(symbols), offsets) for p in range(periods)])
+
+
+def test_integer_seeds_alias_on_the_noise_lattice():
+    # The aliasing the offsets avoid, integer z coordinates 256 apart give the same noise
+    assert np.array_equal(pnoise3_array(0.5, np.arange(20), 3.0), pnoise3_array(0.5, np.arange(20), 259.0))
+
+
+def test_paths_256_apart_do_not_share_noise():
+    for seed in (0, 7, 1000):
+        noise = _path_noise([seed, seed + 256, seed + 512])
+
+        assert not np.array_equal(noise[:, 0], noise[:, 1])
+        assert not np.array_equal(noise[:, 0], noise[:, 2])
+        assert not np.array_equal(noise[:, 1], noise[:, 2])
+
+
+def test_offsets_are_reproducible_per_seed():
+    assert np.array_equal(_noise_offsets(np.array([3, 259])), _noise_offsets(np.array([3, 259])))
+    assert _noise_offsets(np.array([3]))[0] == _noise_offsets(np.array([5, 3]))[1]
+
+
+def test_path_streams_do_not_depend_on_the_batch():
+    high = np.full((3, 40), 1000)
+    batch = PathStreams(np.array([6, 5, 7]))
+    alone = PathStreams(np.array([5]))
+
+    for _ in range(3):
+        assert np.array_equal(batch.integers(0, high, endpoint=True)[1], alone.integers(0, high[:1], endpoint=True)[0])
+
+
+def test_path_outcome_does_not_depend_on_the_batch():
+    batch = run_monte_carlo(0, period=60, seeds=[5, 6, 7])
+    alone = run_monte_carlo(0, period=60, seeds=[5])
+
+    assert batch["terminal_balances"][0] == alone["terminal_balances"][0]
+    assert batch["buy_counts"][0] == alone["buy_counts"][0]
+
+
+def test_runs_without_periods_or_paths_are_rejected():
+    with pytest.raises(ValueError):
+        run_monte_carlo(0, period=0, seeds=[1])
+
+    with pytest.raises(ValueError):
+        run_monte_carlo(0, period=10, seeds=[])
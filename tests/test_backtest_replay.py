@@ -0,0 +1,79 @@
+import csv
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import src.backtest_utils as backtest_utils
+from src.backtest_synchronous import BackTest
+from src.backtest_sweep import run_sweep
+from src.backtest_checkpoint import checkpoint_dir
+
+USER_ID = 990
+PERIOD = 40
+
+
+@pytest.fixture
+def bars(tmp_path):
+    # Period 0 repeats the initial snapshot, later periods walk every symbol away from it
+    prices, volumes = backtest_utils.assure_init_data()
+    registry = backtest_utils.fetch_symbol_registry()
+    generator = np.random.default_rng(3)
+    path = str(tmp_path / "bars.csv")
+    row = np.array(prices, dtype=np.float64)
+
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(("time", "symbol", "price", "volume"))
+
+        for t in range(PERIOD):
+            if t:
+                row = np.maximum(row * (1 + generator.normal(0, 0.02, len(row))), 0.01)
+
+            for i in range(len(registry)):
+                writer.writerow(("{:05d}".format(t), registry.symbol_of(i), repr(float(row[i])), int(volumes[i])))
+
+    yield path
+
+    for backtest_id in range(2):
+        if os.path.exists(backtest_utils.result_path(USER_ID, 0, backtest_id)):
+            os.remove(backtest_utils.result_path(USER_ID, 0, backtest_id))
+
+        shutil.rmtree(checkpoint_dir(USER_ID, 0, backtest_id), ignore_errors=True)
+
+
+def test_replayed_period_0_compares_against_the_first_prices():
+    prices = np.array([[1.0, 2.0], [1.5, 2.5], [0.0, 0.0]])
+    volumes = np.zeros(prices.shape, dtype=np.int64)
+    indices = np.arange(2)
+
+    old, new, _ = backtest_utils.fetch_price_changes(0, prices, volumes, indices, True, np.array([0.5, 2.0]))
+    assert old.tolist() == [0.5, 2.0] and new.tolist() == [1.0, 2.0]
+
+    # Without an initial snapshot period 0 is unchanged, never compared against the last row
+    old, _, change = backtest_utils.fetch_price_changes(0, prices, volumes, indices, True)
+    assert old.tolist() == [1.0, 2.0] and not change.any()
+
+    old, _, _ = backtest_utils.fetch_price_changes(1, prices, volumes, indices, True, np.array([0.5, 2.0]))
+    assert old.tolist() == [1.0, 2.0]
+
+
+def test_replay_without_a_change_in_period_0_does_not_trade(bars):
+    BackTest(USER_ID, 0, 0, period=PERIOD, data_source=bars, checkpoint_interval=0).run_backtest()
+    records = backtest_utils.load_data(USER_ID, 0, 0)
+
+    assert records[0]["buy_count"] == 0 and records[0]["sell_count"] == 0
+    assert sum(r["buy_count"] for r in records) > 0
+
+
+def test_replayed_sweep_matches_a_replayed_synchronous_run(bars):
+    backtest_utils.reset_rng(11)
+    BackTest(USER_ID, 0, 1, period=PERIOD, data_source=bars, checkpoint_interval=0).run_backtest()
+    records = backtest_utils.load_data(USER_ID, 0, 1)
+
+    row = run_sweep(0, [{}], period=PERIOD, data_source=bars, workers=1, seed=11)[0]
+
+    assert row["final_balance"] == records[-1]["balance"]
+    assert row["buy_count"] == sum(r["buy_count"] for r in records)
+    assert row["sell_count"] == sum(r["sell_count"] for r in records)
@@ -0,0 +1,67 @@
+import os
+from threading import Thread
+
+import numpy as np
+
+import src.backtest_utils as backtest_utils
+from src.backtest_utils import SymbolRegistry, refresh_symbol_data, read_symbol_cache, save_symbol_cache, symbols_due
+
+
+def _scraper(calls):
+    # Every symbol but DELISTED fetches
+    def scrape(symbols):
+        calls.append(list(symbols))
+        return {s: 10.0 for s in symbols if s != "DELISTED"}, {s: 100 for s in symbols if s != "DELISTED"}
+
+    return scrape
+
+
+def test_failed_symbols_are_only_retried_after_the_retry_interval(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(backtest_utils, "_scrape_symbol_data", _scraper(calls))
+    monkeypatch.setattr(backtest_utils, "_load_legacy_symbol_data", lambda: None)
+    registry = SymbolRegistry(["AAA", "BBB", "DELISTED"])
+    path = str(tmp_path / "symbol_data.bin")
+
+    refresh_symbol_data(registry, path=path)
+    _, prices, _, fetch_times = read_symbol_cache(path)
+    generated_price = prices[2]
+
+    assert calls == [["AAA", "BBB", "DELISTED"]]
+    assert fetch_times[0] > 0 and fetch_times[2] < 0
+    assert not symbols_due(fetch_times, -fetch_times[2]).any()
+    assert symbols_due(fetch_times, -fetch_times[2] + backtest_utils.SYMBOL_RETRY_INTERVAL).tolist() == [False, False, True]
+
+    # A later start does not fetch again, an explicit refresh retries the failed symbol and keeps its generated data
+    refresh_symbol_data(registry, path=path)
+    assert len(calls) == 1
+
+    refresh_symbol_data(registry, path=path, retry_interval=0)
+    _, prices, _, _ = read_symbol_cache(path)
+
+    assert calls[1] == ["DELISTED"]
+    assert prices[2] == generated_price
+
+
+def test_concurrent_cache_writers_do_not_share_a_temporary_file(tmp_path):
+    registry = SymbolRegistry(["AAA", "BBB"])
+    path = str(tmp_path / "symbol_data.bin")
+    errors = []
+
+    def write():
+        try:
+            for _ in range(50):
+                save_symbol_cache(registry, np.ones(2), np.ones(2, dtype=np.int64), np.ones(2), path)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [Thread(target=write) for _ in range(4)]
+
+    for t in threads:
+        t.start()
+
+    for t in threads:
+        t.join()
+
+    assert not errors
+    assert os.listdir(tmp_path) == ["symbol_data.bin"]